@@ -27,11 +27,19 @@ usage() {
     echo "  -o    Specify the base name to generate output files"
     echo "  -1    Specify the first target VCF file for comparison."
     echo "  -2    Specify the second target VCF file for comparison."
-    echo "  -c    Clustering size to generate regions from SNPs (eg. 100)"
+    echo "  -c    Clustering size to generate regions from SNPs (eg. 100), or comma-separated sizes to compare (eg. 10,50,100)"
     echo ""
     echo "Optional Flags:"
     echo ""
     echo "  -I    Specify a file with a Comparison table (generated by pepa-table)"
+    echo "  -R    Only analyze these comma-separated regions (eg. Chr1:1000000-2000000,Chr2, default whole genome)"
+    echo "  -M    Skip chromosomes with less than this number of SNPs in the parents (eg. 200, default deactive)"
+    echo "  -Z    Write the tables bgzip-compressed (<basename>_*.csv.gz, default deactive)"
+    echo "  -K    Keep heterozygous calls as a Het ancestry state (for diploid crosses, eg. F2 or backcross, not with -F)"
+    echo "  -H    Call the ancestry blocks with a hidden Markov model at this recombination rate (cM/Mb, eg. 1) instead of the clustering (-c not needed)"
+    echo "  -W    Window size (bp) to write a samples x windows matrix of ancestry fractions (default deactive)"
+    echo "  -D    Window size (bp) to write the frequency of each ancestry along the chromosomes, or 0 for exact steps (default deactive)"
+    echo "  -F    Additional founder VCF files for multi-parent crosses, space-separated in quotes (eg. \"P3.vcf P4.vcf\")"
     echo ""
     echo "  -h    Display this help message."
     exit 1
@@ -39,11 +47,19 @@ usage() {
 
 # Default value for the A, G and C flags
 GRAPH=""
+WINDOW=""
+FREQ_WINDOW=""
+REGIONS=""
+MIN_SNPS=""
 GTF=""
 ANNO=""
+FOUNDERS=""
+HMM_RATE=""
+GENOTYPES=""
+EXT=".csv"
 
 # Parse command-line arguments using getopts
-while getopts ":i:I:o:1:2:G:A:c:C:h" opt; do
+while getopts ":i:I:o:1:2:F:G:A:c:C:R:M:H:W:D:KZh" opt; do
     case $opt in
         i )
             if [[ $OUTPUT0 == true ]]; then
@@ -67,6 +83,8 @@ while getopts ":i:I:o:1:2:G:A:c:C:h" opt; do
         ;;
         2) TARGET2="$OPTARG"
         ;;
+        F) FOUNDERS="$OPTARG"
+        ;;
         G )
             if [[ $ANNO == true ]]; then
                 echo "Error: -G and -A flags cannot be used together."
@@ -84,6 +102,20 @@ while getopts ":i:I:o:1:2:G:A:c:C:h" opt; do
             ANNO="$OPTARG"
         ;;
 		c) CSIZE="$OPTARG"
+        ;;
+		W) WINDOW="$OPTARG"
+        ;;
+		D) FREQ_WINDOW="$OPTARG"
+        ;;
+		Z) EXT=".csv.gz"
+        ;;
+		K) GENOTYPES="yes"
+        ;;
+		R) REGIONS="$OPTARG"
+        ;;
+		M) MIN_SNPS="$OPTARG"
+        ;;
+		H) HMM_RATE="$OPTARG"
         ;;
         h) usage
            exit 0
@@ -129,12 +161,24 @@ if [ -z "$TARGET2" ]; then
 	usage
     exit 1
 fi
-if [ -z  "$CSIZE" ]; then
+if [[ -z $CSIZE && -z $HMM_RATE ]]; then
     echo "Error: The size of the regions was not specified"
 	echo ""
 	usage
     exit 1
 fi
+if [[ -n $GENOTYPES && -n $FOUNDERS ]]; then
+    echo "Error: -K can only be used with two parents"
+	echo ""
+	usage
+    exit 1
+fi
+if [[ -n $HMM_RATE && $CSIZE == *,* ]]; then
+    echo "Error: -H cannot be used with several cluster sizes"
+	echo ""
+	usage
+    exit 1
+fi
 
 # Determinate the number of files
 file_length=$(wc -l < "$input_file")
@@ -146,85 +190,173 @@ echo "Number of individuals analyzed: $file_length"
 echo "Base name for the file output: $output_file_base"
 echo "Parent/Ancestry N.1: $TARGET1"
 echo "Parent/Ancestry N.2: $TARGET2"
-echo "Clustering size: $CSIZE"
+N_FOUNDERS=2
+for FOUNDER in $FOUNDERS; do
+	N_FOUNDERS=$((N_FOUNDERS + 1))
+	echo "Parent/Ancestry N.${N_FOUNDERS}: $FOUNDER"
+done
+if [[ -n $HMM_RATE ]]; then
+	echo "Ancestry blocks called with a hidden Markov model (recombination rate: $HMM_RATE cM/Mb)"
+else
+	echo "Clustering size: $CSIZE"
+fi
+if [[ -n $REGIONS ]]; then
+	echo "Regions analyzed: $REGIONS"
+fi
+if [[ -n $GENOTYPES ]]; then
+	echo "Heterozygous calls are kept as a Het ancestry state"
+fi
+if [[ -n $MIN_SNPS ]]; then
+	echo "Chromosomes with less than $MIN_SNPS SNPs will be skipped"
+fi
 echo ""
 
 if [ -n "$input_file" ]; then
-	# Create a temporary output file
-	OUTPUT000=$(mktemp)
+	OUTPUT0="${output_file_base}_Tabulated${EXT}"
+
+	# Restrict the variants to the requested regions and chromosomes while the VCF files are read
+	TABLE_OPTIONS=()
+	if [[ -n $REGIONS ]]; then
+		TABLE_OPTIONS+=(-R "$REGIONS")
+	fi
+	if [[ -n $MIN_SNPS ]]; then
+		TABLE_OPTIONS+=(-M "$MIN_SNPS")
+	fi
+	# Genotype codes keep the heterozygous and missing calls
+	if [[ -n $GENOTYPES ]]; then
+		TABLE_OPTIONS+=(-GENOTYPES)
+	fi
 
 	# Part 0: Prepare the data from genome painting
 	echo "Running Part 0: Generating a tabulate version of VCF files provided..."
-	# Call a Python script for processing using TARGET1 and TARGET2
-	python "${script_path}/PePa_BC_VCFtoTable.py" -L "$input_file" -P1 "$TARGET1" -P2 "$TARGET2" -O "$OUTPUT000"
+	# Call a Python script for processing using TARGET1 and TARGET2, writing the Tabulated file in a single pass
+	if [[ -n $FOUNDERS ]]; then
+		python "${script_path}/PePa_BC_VCFtoTable.py" -L "$input_file" -P1 "$TARGET1" -P2 "$TARGET2" -PX $FOUNDERS -O "$OUTPUT0" -NORMALISE "${TABLE_OPTIONS[@]}"
+	else
+		python "${script_path}/PePa_BC_VCFtoTable.py" -L "$input_file" -P1 "$TARGET1" -P2 "$TARGET2" -O "$OUTPUT0" -NORMALISE "${TABLE_OPTIONS[@]}"
+	fi
 	echo "Part 0: Complete"
 	echo ""
-
-	OUTPUT0=$(mktemp)
-	TABULATED="${output_file_base}_Tabulated.csv"
-
-	sed 's/.vcf.gz//g' $OUTPUT000 | sed 's/-/0/g' | tr ',' '\t' > $OUTPUT0
-	sed 's/.vcf.gz//g' $OUTPUT000 | sed 's/-/0/g' | tr ',' '\t' > $TABULATED
-
 fi
 
-# Get unique chromosome names (first column) and store them in $chromosomes
-chromosomes0=$(awk 'NR>1 {print $1}' "$OUTPUT0" | sort -u)
-chromosomes=$(awk 'NR>1 {print $1}' "$OUTPUT0" | sort | uniq -c | awk '$1 > 200 {print $2}')
-
 # Get the number of columns in the first row using cut and wc
-num_columns=$(head -n 1 "$OUTPUT0" | tr '\t' '\n' | wc -l)
+num_columns=$(gzip -cdf "$OUTPUT0" | head -n 1 | tr '\t' '\n' | wc -l)
 
-# Generate the list of column numbers from 6 to the total number of columns
+# Generate the list of column numbers from the first individual to the total number of columns
 # The columns 1 is Chromosomes, 2 is Position, 3 is Reference, 4 is Parent1 (TARGET1), 5 is Parent2 (TARGET2)
-# From 6 onward are individuals (each VCF file in -L) under analysis
-columns=$(seq 6 "$num_columns")
+# Additional founders (-F) follow the parents, then come the individuals (each VCF file in -L) under analysis
+columns=$(seq $((4 + N_FOUNDERS)) "$num_columns")
 
-# Prepare grep pattern by converting the chromosome list to a space-separated string
-grep_pattern=$(echo "$chromosomes" | tr '\n' ' ')
 # Prepare target columns by converting the column numbers to a space-separated string
 target_columns=$(echo "$columns" | tr '\n' ' ')
 
 # Fixed parameters
 print_columns="1 2"
-compare_columns="4 5"
+compare_columns=$(seq 4 $((3 + N_FOUNDERS)) | tr '\n' ' ')
+
+# With more than two founders each SNP stores the bitmask of matching founders
+MASK_FLAG=""
+if [[ $N_FOUNDERS -gt 2 ]]; then
+	MASK_FLAG="-MASK"
+fi
+
+# Genotype tables are classified as Ancestry1, Ancestry2, Het or Unknown; other tables drop the BOTH sites
+COMPARE_MODE="-b"
+if [[ -n $GENOTYPES ]]; then
+	COMPARE_MODE="-g"
+fi
 
 # Part 1: Run the first script
-OUTPUT1=$(mktemp)
-FILT1="${output_file_base}_Transformed.csv"
+FILT1="${output_file_base}_Transformed${EXT}"
 
 echo "Running Part 1: Transforming Tabulated VCF file into Comparison File"
-python "${script_path}/PePa_BC_ComparisonTable.py" -i "$OUTPUT0" -o "$OUTPUT1" -p "$print_columns" -t "$target_columns" -c "$compare_columns" 
+python "${script_path}/PePa_BC_ComparisonTable.py" -i "$OUTPUT0" -o "$FILT1" -p "$print_columns" -t "$target_columns" -c "$compare_columns" $COMPARE_MODE
 echo "Part 1: Complete"
-grep -v -e BOTH $OUTPUT1 > $FILT1
 echo ""
 
-# Part 2: Run the Second script
-echo "Running Part 2: Clustering SNPs into ancestry regions"
-python "${script_path}/PePa_BC_ClusteringSNPs.py" "$FILT1" "$output_file_base"  -CLUSTER "$CSIZE"
-echo "Part 2: Complete"
-echo ""
+if [[ $CSIZE == *,* ]]; then
+	# Several cluster sizes: the comparison table is parsed once and every size is clustered in parallel,
+	# each size writing its own set of outputs named <basename>_c<size>_*
+	SWEEP_GZ=""
+	if [[ $EXT == .csv.gz ]]; then
+		SWEEP_GZ="-GZ"
+	fi
+	echo "Running Part 2 and 3: Clustering SNPs into ancestry regions with cluster sizes $CSIZE"
+	python "${script_path}/PePa_BC_ClusterSweep.py" "$FILT1" "$output_file_base" -CLUSTER "$CSIZE" $MASK_FLAG $SWEEP_GZ
+	echo "Part 2 and 3: Complete"
+	echo ""
 
-# Part 3: Run the Third script
-OUTPUT3=$(mktemp)
-SUFFIX="_CLUST_"
-FILT3="${output_file_base}_ClusteredRaw.csv"
-echo "Running Part 3: Combining clustering files from Individuals to a single file"
-python "${script_path}/PePa_BC_ClustCombine.py" -S "$SUFFIX" -o "$OUTPUT3"
+	if [ -n "$WINDOW" ]; then
+		# Optional code: Ancestry fractions on a common grid of windows
+		echo "Running Optional code: Computing ancestry fractions in windows of $WINDOW bp..."
+		for SIZE in $(echo "$CSIZE" | tr ',' ' '); do
+			python "${script_path}/PePa_BC_WindowMatrix.py" -I "${output_file_base}_c${SIZE}_Clustered${EXT}" -O "${output_file_base}_c${SIZE}_WindowMatrix.tsv.gz" -W "$WINDOW"
+		done
+		echo "Optional code: Complete"
+		echo ""
+	fi
+
+	if [ -n "$FREQ_WINDOW" ]; then
+		# Optional code: Frequency of each ancestry along the chromosomes
+		echo "Running Optional code: Computing the frequency of each ancestry along the chromosomes..."
+		for SIZE in $(echo "$CSIZE" | tr ',' ' '); do
+			python "${script_path}/PePa_BC_AncestryFreq.py" -I "${output_file_base}_c${SIZE}_Clustered${EXT}" -O "${output_file_base}_c${SIZE}_AncestryFreq${EXT/csv/tsv}" -W "$FREQ_WINDOW"
+		done
+		echo "Optional code: Complete"
+		echo ""
+	fi
+
+	exit 0
+fi
 
-sed 's/_CLUST_Individual//g' $OUTPUT3 | sed 's/.csv//g' > $FILT3
+FILT3="${output_file_base}_ClusteredRaw${EXT}"
+REFINE="${output_file_base}_Clustered${EXT}"
 
-REFINE="${output_file_base}_Clustered.csv"
-SEL=$((CSIZE * 10))
+if [[ -n $HMM_RATE ]]; then
+	# Part 2 and 3 with the hidden Markov model: the decoded blocks are used both as raw and refined clusters
+	echo "Running Part 2 and 3: Calling ancestry blocks with a hidden Markov model"
+	python "${script_path}/PePa_BC_HMMAncestry.py" "$FILT1" "$output_file_base" -O "$REFINE" -RATE "$HMM_RATE" $MASK_FLAG
+	cp "$REFINE" "$FILT3"
+	echo "Part 2 and 3: Complete"
+	echo ""
+else
+	# Part 2: Run the Second script
+	echo "Running Part 2: Clustering SNPs into ancestry regions"
+	python "${script_path}/PePa_BC_ClusteringSNPs.py" "$FILT1" "$output_file_base"  -CLUSTER "$CSIZE" $MASK_FLAG
+	echo "Part 2: Complete"
+	echo ""
 
-echo "Refining clusters.."
-echo "To generate ancestry blocks, clusters of the following size will be ignored:" "$SEL"
-python "${script_path}/PePa_BC_ClusterClusters.py" -I "$FILT3" -O "$REFINE"  -N "$SEL"
+	# Part 3: Run the Third script
+	SUFFIX="_CLUST_"
+	echo "Running Part 3: Combining clustering files from Individuals to a single file"
+	python "${script_path}/PePa_BC_ClustCombine.py" -S "$SUFFIX" -o "$FILT3" -n
 
-echo "Part 3: Complete"
-echo ""
+	SEL=$((CSIZE * 10))
+
+	echo "Refining clusters.."
+	echo "To generate ancestry blocks, clusters of the following size will be ignored:" "$SEL"
+	python "${script_path}/PePa_BC_ClusterClusters.py" -I "$FILT3" -O "$REFINE"  -N "$SEL"
 
+	echo "Part 3: Complete"
+	echo ""
+
+	# zipping files to clean not clutter the folder
+	ZIPPED="${output_file_base}_Clusters.zip"
+	zip -m -q $ZIPPED *_CLUST_*.csv
+fi
 
-# zipping files to clean not clutter the folder
-ZIPPED="${output_file_base}_Clusters.zip"
-zip -m -q $ZIPPED *_CLUST_*.csv
+if [ -n "$WINDOW" ]; then
+	# Optional code: Ancestry fractions on a common grid of windows
+	echo "Running Optional code: Computing ancestry fractions in windows of $WINDOW bp..."
+	python "${script_path}/PePa_BC_WindowMatrix.py" -I "$REFINE" -O "${output_file_base}_WindowMatrix.tsv.gz" -W "$WINDOW"
+	echo "Optional code: Complete"
+	echo ""
+fi
+
+if [ -n "$FREQ_WINDOW" ]; then
+	# Optional code: Frequency of each ancestry along the chromosomes
+	echo "Running Optional code: Computing the frequency of each ancestry along the chromosomes..."
+	python "${script_path}/PePa_BC_AncestryFreq.py" -I "$REFINE" -O "${output_file_base}_AncestryFreq${EXT/csv/tsv}" -W "$FREQ_WINDOW"
+	echo "Optional code: Complete"
+	echo ""
+fi
@@ -27,11 +27,20 @@ usage() {
     echo "  -o    Specify the base name to generate output files"
     echo "  -1    Specify the first target VCF file for comparison."
     echo "  -2    Specify the second target VCF file for comparison."
-    echo "  -c    Clustering size to generate regions from SNPs (eg. 100)"
+    echo "  -c    Clustering size to generate regions from SNPs (eg. 100), or comma-separated sizes to compare (eg. 10,50,100)"
     echo ""
     echo "Optional Flags:"
     echo ""
     echo "  -I    Specify a file with a Comparison table (generated by pepa-table)"
+    echo "  -S    Number of sample shards to tabulate the VCF files in parallel workers (eg. 8, default deactive)"
+    echo "  -R    Only analyze these comma-separated regions (eg. Chr1:1000000-2000000,Chr2, default whole genome)"
+    echo "  -M    Skip chromosomes with less than this number of SNPs in the parents (eg. 200, default deactive)"
+    echo "  -B    Render the plots in parallel shards of this number of samples, or one shard per chromosome with -B chr (default deactive)"
+    echo "  -Z    Write the tables bgzip-compressed (<basename>_*.csv.gz, default deactive)"
+    echo "  -K    Keep heterozygous calls as a Het ancestry state (for diploid crosses, eg. F2 or backcross, default deactive)"
+    echo "  -H    Call the ancestry blocks with a hidden Markov model at this recombination rate (cM/Mb, eg. 1) instead of the clustering (default deactive)"
+    echo "  -W    Window size (bp) to write a samples x windows matrix of ancestry fractions (default deactive)"
+    echo "  -D    Window size (bp) to write the frequency of each ancestry along the chromosomes, or 0 for exact steps (default deactive)"
     echo "  -G    GTF file to convert to Anno and use"
     echo "  -A    Annotation file (Anno) where all the genes in the genome are present"
 	echo "  -C    Optional flag to plot % of chromosomes belonging to each ancestry (default deactive)"
@@ -42,11 +51,20 @@ usage() {
 
 # Default value for the A, G and C flags
 GRAPH=""
+WINDOW=""
+FREQ_WINDOW=""
+REGIONS=""
+MIN_SNPS=""
+SHARDS=""
+EXT=".csv"
+RENDER=""
+HMM_RATE=""
+GENOTYPES=""
 GTF=""
 ANNO=""
 
 # Parse command-line arguments using getopts
-while getopts ":i:I:o:1:2:G:A:c:C:h" opt; do
+while getopts ":i:I:o:1:2:G:A:c:C:S:R:M:B:H:W:D:KZh" opt; do
     case $opt in
         i )
             if [[ $OUTPUT0 == true ]]; then
@@ -89,6 +107,24 @@ while getopts ":i:I:o:1:2:G:A:c:C:h" opt; do
 		c) CSIZE="$OPTARG"
         ;;
 		C) GRAPH="$OPTARG"
+        ;;
+		W) WINDOW="$OPTARG"
+        ;;
+		D) FREQ_WINDOW="$OPTARG"
+        ;;
+		R) REGIONS="$OPTARG"
+        ;;
+		M) MIN_SNPS="$OPTARG"
+        ;;
+		S) SHARDS="$OPTARG"
+        ;;
+		B) RENDER="$OPTARG"
+        ;;
+		H) HMM_RATE="$OPTARG"
+        ;;
+		Z) EXT=".csv.gz"
+        ;;
+		K) GENOTYPES="yes"
         ;;
         h) usage
            exit 0
@@ -127,22 +163,42 @@ if [ -z "$TARGET2" ]; then
 	usage
     exit 1
 fi
-if [ -z  "$CSIZE" ]; then
+if [[ -z $CSIZE && -z $HMM_RATE ]]; then
     echo "Error: The size of the regions was not specified"
 	echo ""
 	usage
     exit 1
 fi
+# With the hidden Markov model, the size of the regions is only used by the percentage plot
+if [[ -n $HMM_RATE && -n $GRAPH && -z $CSIZE ]]; then
+    echo "Error: -C needs the size of the regions (-c) to be specified with -H"
+	echo ""
+	usage
+    exit 1
+fi
+
+if [[ -n $HMM_RATE && $CSIZE == *,* ]]; then
+    echo "Error: -H cannot be used with several cluster sizes"
+	echo ""
+	usage
+    exit 1
+fi
+
+if [[ -n $RENDER && $RENDER != chr && ! $RENDER =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: -B must be a number of samples or chr"
+	echo ""
+	usage
+    exit 1
+fi
 
-# Run the specific script if -G is true
 if [[ -n $GTF ]]; then
-    echo "GTF files provided, converting into annotation file..."
 	ANNO="${output_file_base}.anno"
-    python "${script_path}/PePa_PC_ExtracGTF.py" -I "$GTF" -O "$ANNO"
 fi
 
 # Determinate the number of files
-file_length=$(wc -l < "$input_file")
+if [[ -n "$input_file" ]]; then
+	file_length=$(wc -l < "$input_file")
+fi
 
 # Debugging
 echo "Input info:"
@@ -153,7 +209,21 @@ fi
 echo "Base name for the file output: $output_file_base"
 echo "Parent/Ancestry N.1: $TARGET1"
 echo "Parent/Ancestry N.2: $TARGET2"
-echo "Clustering size: $CSIZE"
+if [[ -n $CSIZE ]]; then
+	echo "Clustering size: $CSIZE"
+fi
+if [[ -n $REGIONS ]]; then
+	echo "Regions analyzed: $REGIONS"
+fi
+if [[ -n $HMM_RATE ]]; then
+	echo "Ancestry blocks called with a hidden Markov model (recombination rate: $HMM_RATE cM/Mb)"
+fi
+if [[ -n $GENOTYPES ]]; then
+	echo "Heterozygous calls are kept as a Het ancestry state"
+fi
+if [[ -n $MIN_SNPS ]]; then
+	echo "Chromosomes with less than $MIN_SNPS SNPs will be skipped"
+fi
 echo ""
 
 if [[ -z $GTF && -z $ANNO ]]; then
@@ -165,111 +235,412 @@ if [[ -n $GTF || -n $ANNO ]]; then
 fi
 
 
-if [ -n "$input_file" ]; then
-	# Create a temporary output file
-	OUTPUT000=$(mktemp)
+# Stages of the pipeline
+# The pipeline is a DAG of stages, each declaring its dependencies, input files and output files.
+# Every stage starts at once in a background subshell that waits for its own dependencies, so a stage runs as soon as
+# they are complete, independently of the other branches. The exit status of each stage is written in <name>.status,
+# which its dependents wait for. A stage is skipped when all its outputs are newer than its inputs and it was last run
+# with the same command and parameters, so a re-run only redoes stale work. Commands of completed stages are recorded
+# in the <basename>_stages folder.
+STAGE_DIR="${output_file_base}_stages"
+mkdir -p "$STAGE_DIR"
+declare -A STAGE_PID
+declare -A STAGE_STATUS
+
+# Check whether the outputs of a stage are up to date
+stage_is_fresh() {
+	local name="$1" inputs="$2" outputs="$3" command="$4"
+	local stamp="${STAGE_DIR}/${name}.cmd"
+	local output input
+
+	# The stage must have completed before with the same command and parameters
+	if [[ ! -f "$stamp" || "$(cat "$stamp")" != "$command" ]]; then
+		return 1
+	fi
+
+	for output in $outputs; do
+		if [[ ! -e "$output" ]]; then
+			return 1
+		fi
+		for input in $inputs; do
+			if [[ "$input" -nt "$output" ]]; then
+				return 1
+			fi
+		done
+	done
+	return 0
+}
 
-	# Part 0: Prepare the data from genome painting
-	echo "Running Part 0: Generating a tabulate version of VCF files provided..."
-	# Call a Python script for processing using TARGET1 and TARGET2
-	python "${script_path}/PePa_BC_VCFtoTable.py" -L "$input_file" -P1 "$TARGET1" -P2 "$TARGET2" -O "$OUTPUT000"
-	echo "Part 0: Complete"
-	echo ""
+# Wait, from the subshell of another stage, until a stage has finished (returns the exit status of the stage)
+# Usage: wait_dependency NAME
+wait_dependency() {
+	local name="$1"
+	local status_file="${STAGE_DIR}/${name}.status"
+
+	# Stages are not children of each other, so the status file is polled; a stage that died without writing it failed
+	while [[ ! -f "$status_file" ]]; do
+		if ! kill -0 "${STAGE_PID[$name]}" 2>/dev/null && [[ ! -f "$status_file" ]]; then
+			return 1
+		fi
+		sleep 0.2
+	done
+	return "$(cat "$status_file")"
+}
 
-	OUTPUT0=$(mktemp)
-	TABULATED="${output_file_base}_Tabulated.csv"
+# Body of a stage, run in its own subshell
+run_stage() {
+	local name="$1" dependencies="$2" inputs="$3" outputs="$4"
+	shift 4
+	local dependency
+
+	for dependency in $dependencies; do
+		if ! wait_dependency "$dependency"; then
+			echo "Stage $name not run: stage $dependency failed"
+			return 1
+		fi
+	done
+
+	if stage_is_fresh "$name" "$inputs" "$outputs" "$*"; then
+		echo "Stage $name skipped: outputs are up to date"
+		return 0
+	fi
+
+	# Forget the previous run so an interrupted stage is never considered up to date
+	rm -f "${STAGE_DIR}/${name}.cmd"
+	"$@" && echo "$*" > "${STAGE_DIR}/${name}.cmd"
+}
 
-	sed 's/.vcf.gz//g' $OUTPUT000 | sed 's/-/0/g' | tr ',' '\t' > $OUTPUT0
-	sed 's/.vcf.gz//g' $OUTPUT000 | sed 's/-/0/g' | tr ',' '\t' > $TABULATED
+# Usage: start_stage NAME "DEPENDENCIES" "INPUTS" "OUTPUTS" COMMAND [ARGS...]
+start_stage() {
+	local name="$1" dependencies="$2"
+	local dependency
+
+	# Dependencies must be started first, so the stages always form a DAG
+	for dependency in $dependencies; do
+		if [[ -z ${STAGE_PID[$dependency]+set} ]]; then
+			echo "Error: Stage $name depends on stage $dependency, which was not started"
+			exit 1
+		fi
+	done
+
+	# The status of a previous run must not release the dependents of this one
+	rm -f "${STAGE_DIR}/${name}.status"
+	(
+		# A failure anywhere in a pipe fails the stage
+		set -o pipefail
+		run_stage "$@"
+		status=$?
+		echo "$status" > "${STAGE_DIR}/${name}.status.tmp" && mv "${STAGE_DIR}/${name}.status.tmp" "${STAGE_DIR}/${name}.status"
+		exit "$status"
+	) &
+	STAGE_PID[$name]=$!
+}
 
-fi
+# Usage: wait_stage NAME (returns the exit status of the stage)
+wait_stage() {
+	local name="$1"
+	if [[ -z ${STAGE_STATUS[$name]+set} ]]; then
+		wait "${STAGE_PID[$name]}"
+		STAGE_STATUS[$name]=$?
+	fi
+	return ${STAGE_STATUS[$name]}
+}
 
-# Get unique chromosome names (first column) and store them in $chromosomes
-chromosomes0=$(awk 'NR>1 {print $1}' "$OUTPUT0" | sort -u)
-chromosomes=$(awk 'NR>1 {print $1}' "$OUTPUT0" | sort | uniq -c | awk '$1 > 200 {print $2}')
+# Optional code 0: Convert the GTF file into an annotation file
+convert_gtf() {
+	echo "GTF files provided, converting into annotation file..."
+	python "${script_path}/PePa_PC_ExtracGTF.py" -I "$1" -O "$2"
+}
 
-# Get the number of columns in the first row using cut and wc
-num_columns=$(head -n 1 "$OUTPUT0" | tr '\t' '\n' | wc -l)
+# Part 0: Prepare the data from genome painting
+tabulate_vcfs() {
+	local list="$1" target1="$2" target2="$3" tabulated="$4" shards="$5" regions="$6" min_snps="$7" genotypes="$8"
+
+	# Restrict the variants to the requested regions and chromosomes while the VCF files are read
+	local options=()
+	if [[ -n $regions ]]; then
+		options+=(-R "$regions")
+	fi
+	if [[ -n $min_snps ]]; then
+		options+=(-M "$min_snps")
+	fi
+	# Genotype codes keep the heterozygous and missing calls
+	if [[ -n $genotypes ]]; then
+		options+=(-GENOTYPES)
+	fi
 
-# Generate the list of column numbers from 6 to the total number of columns
-# The columns 1 is Chromosomes, 2 is Position, 3 is Reference, 4 is Parent1 (TARGET1), 5 is Parent2 (TARGET2)
-# From 6 onward are individuals (each VCF file in -L) under analysis
-columns=$(seq 6 "$num_columns")
+	echo "Running Part 0: Generating a tabulate version of VCF files provided..."
+	if [[ -n $shards ]]; then
+		# Sample shards are leased from a queue on the filesystem; other nodes can join with:
+		# python PePa_BC_ShardTable.py -WORKER -Q <basename>_shards
+		python "${script_path}/PePa_BC_ShardTable.py" -L "$list" -P1 "$target1" -P2 "$target2" -O "$tabulated" -NORMALISE \
+			-N "$shards" -Q "${output_file_base}_shards" "${options[@]}" || return 1
+	else
+		# Call a Python script for processing using TARGET1 and TARGET2
+		python "${script_path}/PePa_BC_VCFtoTable.py" -L "$list" -P1 "$target1" -P2 "$target2" -O "$tabulated" -NORMALISE "${options[@]}" || return 1
+	fi
+	echo "Part 0: Complete"
+	echo ""
+}
 
-# Prepare grep pattern by converting the chromosome list to a space-separated string
-grep_pattern=$(echo "$chromosomes" | tr '\n' ' ')
-# Prepare target columns by converting the column numbers to a space-separated string
-target_columns=$(echo "$columns" | tr '\n' ' ')
+# Part 1: Transform the tabulated VCF file into the comparison file
+compare_table() {
+	local tabulated="$1" transformed="$2" print_columns="$3" target_columns="$4" compare_columns="$5" genotypes="$6"
 
-# Fixed parameters
-print_columns="1 2"
-compare_columns="4 5"
+	# Genotype tables are classified as Ancestry1, Ancestry2, Het or Unknown; other tables drop the BOTH sites
+	local mode=-b
+	if [[ -n $genotypes ]]; then
+		mode=-g
+	fi
 
-# Part 1: Run the first script
-OUTPUT1=$(mktemp)
-FILT1="${output_file_base}_Transformed.csv"
+	echo "Running Part 1: Transforming Tabulated VCF file into Comparison File"
+	python "${script_path}/PePa_BC_ComparisonTable.py" -i "$tabulated" -o "$transformed" -p "$print_columns" -t "$target_columns" -c "$compare_columns" $mode || return 1
+	echo "Part 1: Complete"
+	echo ""
+}
 
-echo "Running Part 1: Transforming Tabulated VCF file into Comparison File"
-python "${script_path}/PePa_BC_ComparisonTable.py" -i "$OUTPUT0" -o "$OUTPUT1" -p "$print_columns" -t "$target_columns" -c "$compare_columns" 
-echo "Part 1: Complete"
-grep -v -e BOTH $OUTPUT1 > $FILT1
-echo ""
+# Part 2 and 3: Cluster SNPs into ancestry regions and combine the Individuals into a single file
+cluster_snps() {
+	local transformed="$1" base="$2" csize="$3" clustered_raw="$4"
 
-# Part 2: Run the Second script
-echo "Running Part 2: Clustering SNPs into ancestry regions"
-python "${script_path}/PePa_BC_ClusteringSNPs.py" "$FILT1" "$output_file_base"  -CLUSTER "$CSIZE"
-echo "Part 2: Complete"
-echo ""
+	echo "Running Part 2: Clustering SNPs into ancestry regions"
+	python "${script_path}/PePa_BC_ClusteringSNPs.py" "$transformed" "$base"  -CLUSTER "$csize" || return 1
+	echo "Part 2: Complete"
+	echo ""
 
-# Part 3: Run the Third script
-OUTPUT3=$(mktemp)
-SUFFIX="_CLUST_"
-FILT3="${output_file_base}_ClusteredRaw.csv"
-echo "Running Part 3: Combining clustering files from Individuals to a single file"
-python "${script_path}/PePa_BC_ClustCombine.py" -S "$SUFFIX" -o "$OUTPUT3"
+	echo "Running Part 3: Combining clustering files from Individuals to a single file"
+	python "${script_path}/PePa_BC_ClustCombine.py" -S "_CLUST_" -o "$clustered_raw" -n || return 1
 
-sed 's/_CLUST_Individual//g' $OUTPUT3 | sed 's/.csv//g' > $FILT3
+	# zipping files to clean not clutter the folder
+	zip -m -q "${base}_Clusters.zip" *_CLUST_*.csv
+}
 
-REFINE="${output_file_base}_Clustered.csv"
-SEL=$((CSIZE * 10))
+# Part 3: Refine the clusters into ancestry blocks
+refine_clusters() {
+	local clustered_raw="$1" refined="$2" sel="$3"
 
-echo "Refining clusters.."
-echo "To generate ancestry blocks, clusters of the following size will be ignored:" "$SEL"
-python "${script_path}/PePa_BC_ClusterClusters.py" -I "$FILT3" -O "$REFINE"  -N "$SEL"
+	echo "Refining clusters.."
+	echo "To generate ancestry blocks, clusters of the following size will be ignored:" "$sel"
+	python "${script_path}/PePa_BC_ClusterClusters.py" -I "$clustered_raw" -O "$refined"  -N "$sel" || return 1
+	echo "Part 3: Complete"
+	echo ""
+}
 
-echo "Part 3: Complete"
-echo ""
+# Part 2 and 3 for several cluster sizes at once
+sweep_clusters() {
+	echo "Running Part 2 and 3: Clustering SNPs into ancestry regions with cluster sizes $3"
+	python "${script_path}/PePa_BC_ClusterSweep.py" "$1" "$2" -CLUSTER "$3" $4 || return 1
+	echo "Part 2 and 3: Complete"
+	echo ""
+}
 
+# Part 2 and 3 with the hidden Markov model: the decoded blocks are used both as raw and refined clusters
+hmm_ancestry() {
+	local transformed="$1" base="$2" rate="$3" clustered_raw="$4" refined="$5"
 
-# zipping files to clean not clutter the folder
-ZIPPED="${output_file_base}_Clusters.zip"
-zip -m -q $ZIPPED *_CLUST_*.csv
+	echo "Running Part 2 and 3: Calling ancestry blocks with a hidden Markov model"
+	python "${script_path}/PePa_BC_HMMAncestry.py" "$transformed" "$base" -O "$refined" -RATE "$rate" || return 1
+	cp "$refined" "$clustered_raw" || return 1
+	echo "Part 2 and 3: Complete"
+	echo ""
+}
 
-# Part 4: Run the Fourth script
-echo "Running Part 4: Painting chromosome depending on Ancestry"
-Rscript  "${script_path}/PePa_PC_GenomePaint.r" "$REFINE" "$output_file_base"
-echo "Part 4: Complete"
-echo ""
+# Render a plot in shards of samples (or one shard per chromosome with "chr"), running the R scripts in parallel
+# Usage: render_shards PLOT INPUT BASE BATCH [OPTIONS...]
+render_shards() {
+	local plot="$1" input="$2" base="$3" batch="$4"
+	shift 4
+	local options=(-B "$batch")
+	if [[ $batch == chr ]]; then
+		options=(-CHR)
+	fi
+	python "${script_path}/PePa_PC_RenderShards.py" -T "$plot" -I "$input" -O "$base" "${options[@]}" "$@"
+}
 
+# Part 4: Paint chromosomes depending on Ancestry
+paint_genome() {
+	echo "Running Part 4: Painting chromosome depending on Ancestry"
+	if [[ -n $3 ]]; then
+		render_shards paint "$1" "$2" "$3" || return 1
+	else
+		Rscript  "${script_path}/PePa_PC_GenomePaint.r" "$1" "$2" || return 1
+	fi
+	echo "Part 4: Complete"
+	echo ""
+}
 
-if [ -n "$GRAPH" ]; then
-	# Optional code 1: Run  optional script for ancestry computation: % of Genome
+# Optional code 1: Run  optional script for ancestry computation: % of Genome
+genome_percentage() {
 	echo "Running Optional code: Plotting percentage of ancestry of each genome..."
-	Rscript  "${script_path}/PePa_PC_ntPerc.r" "$FILT3" "$output_file_base" "$CSIZE"
+	if [[ -n $4 ]]; then
+		render_shards genome "$1" "$2" "$4" -S "$3" || return 1
+	else
+		Rscript  "${script_path}/PePa_PC_ntPerc.r" "$1" "$2" "$3" || return 1
+	fi
 	echo "Optional code 1: Complete"
+}
 
-fi
+# Optional code 2: Run  optional script for ancestry computation: % of Genes
+gene_ancestry() {
+	local anno="$1" clustered_raw="$2" genetab="$3" base="$4" render="$5"
 
-if [ -n "$ANNO" ]; then
-	# Optional code 2: Run  optional script for ancestry computation: % of Genes
-	GENETAB="${output_file_base}_GeneAnc.csv"
 	echo "Running Optional code: Plotting ancestry of each gene..."
-	python "${script_path}/PePa_PC_GeneToClustRep.py" -g "$ANNO" -a "$FILT3" -o "$GENETAB" 
-	echo "Ancestry of each computed in: " "$GENETAB"
-	Rscript  "${script_path}/PePa_PC_GeneCountPerc.r" "$GENETAB" "$output_file_base" 
+	python "${script_path}/PePa_PC_GeneToClustRep.py" -g "$anno" -a "$clustered_raw" -o "$genetab" || return 1
+	echo "Ancestry of each computed in: " "$genetab"
+	if [[ -n $render ]]; then
+		render_shards genes "$genetab" "$base" "$render" || return 1
+	else
+		Rscript  "${script_path}/PePa_PC_GeneCountPerc.r" "$genetab" "$base" || return 1
+	fi
 	echo "Optional code 2: Complete"
-	
+}
+
+# Optional code 3: Ancestry fractions on a common grid of windows
+window_matrix() {
+	echo "Running Optional code: Computing ancestry fractions in windows of $3 bp..."
+	python "${script_path}/PePa_BC_WindowMatrix.py" -I "$1" -O "$2" -W "$3" || return 1
+	echo "Optional code 3: Complete"
+}
+
+# Optional code 4: Frequency of each ancestry along the chromosomes
+ancestry_frequency() {
+	local window_options=()
+	if [[ $3 -gt 0 ]]; then
+		window_options=(-W "$3")
+	fi
+	echo "Running Optional code: Computing the frequency of each ancestry along the chromosomes..."
+	python "${script_path}/PePa_BC_AncestryFreq.py" -I "$1" -O "$2" "${window_options[@]}" || return 1
+	echo "Optional code 4: Complete"
+}
+
+
+# The GTF conversion only feeds the gene branch, so it overlaps with Part 0
+if [[ -n $GTF ]]; then
+	start_stage gtf "" "$GTF" "$ANNO" convert_gtf "$GTF" "$ANNO"
 fi
 
+TABULATED="${output_file_base}_Tabulated${EXT}"
+if [ -n "$input_file" ]; then
+	start_stage tabulate "" "$input_file $TARGET1 $TARGET2 $(cat "$input_file")" "$TABULATED" \
+		tabulate_vcfs "$input_file" "$TARGET1" "$TARGET2" "$TABULATED" "$SHARDS" "$REGIONS" "$MIN_SNPS" "$GENOTYPES"
+	# The columns of the individuals are read from the table, so the main shell waits for it (the GTF conversion goes on)
+	wait_stage tabulate || { echo "Part 0 failed"; exit 1; }
+else
+	TABULATED="$OUTPUT0"
+fi
+
+# Get the number of columns in the first row using cut and wc
+num_columns=$(gzip -cdf "$TABULATED" | head -n 1 | tr '\t' '\n' | wc -l)
+
+# Generate the list of column numbers from 6 to the total number of columns
+# The columns 1 is Chromosomes, 2 is Position, 3 is Reference, 4 is Parent1 (TARGET1), 5 is Parent2 (TARGET2)
+# From 6 onward are individuals (each VCF file in -L) under analysis
+columns=$(seq 6 "$num_columns")
+
+# Prepare target columns by converting the column numbers to a space-separated string
+target_columns=$(echo "$columns" | tr '\n' ' ')
+
+# Fixed parameters
+print_columns="1 2"
+compare_columns="4 5"
+
+FILT1="${output_file_base}_Transformed${EXT}"
+
+start_stage compare "" "$TABULATED" "$FILT1" \
+	compare_table "$TABULATED" "$FILT1" "$print_columns" "$target_columns" "$compare_columns" "$GENOTYPES"
+
+# Usage: start_outputs SUFFIX RAW_STAGE REFINED_STAGE BASE CSIZE
+# Starts the stages using the clusters of one cluster size
+start_outputs() {
+	local suffix="$1" raw_stage="$2" refined_stage="$3" base="$4" csize="$5"
+	local clustered_raw="${base}_ClusteredRaw${EXT}"
+	local refined="${base}_Clustered${EXT}"
+
+	# Plots rendered in shards are listed in <base>_<Plot>Shards.tsv instead of being written as a single file
+	local genome_plot="${base}_GenomeBarPlot.pdf" gene_plot="${base}_GeneBarPlot.pdf" paint_plot="${base}_PePa_Paint.png"
+	if [[ -n $RENDER ]]; then
+		genome_plot="${base}_GenomeShards.tsv"
+		gene_plot="${base}_GenesShards.tsv"
+		paint_plot="${base}_PaintShards.tsv"
+	fi
+
+	# The optional branches only depend on the raw clusters, so they run alongside the refinement and the painting
+	if [ -n "$GRAPH" ]; then
+		start_stage "genome${suffix}" "$raw_stage" "$clustered_raw" "$genome_plot ${base}_GenomePercentage.csv" \
+			genome_percentage "$clustered_raw" "$base" "$csize" "$RENDER"
+	fi
+
+	if [ -n "$ANNO" ]; then
+		local gene_dependencies="$raw_stage"
+		if [[ -n $GTF ]]; then
+			gene_dependencies="gtf $raw_stage"
+		fi
+		start_stage "genes${suffix}" "$gene_dependencies" "$ANNO $clustered_raw" "${base}_GeneAnc${EXT} $gene_plot" \
+			gene_ancestry "$ANNO" "$clustered_raw" "${base}_GeneAnc${EXT}" "$base" "$RENDER"
+	fi
+
+	if [ -n "$WINDOW" ]; then
+		start_stage "windows${suffix}" "$refined_stage" "$refined" "${base}_WindowMatrix.tsv.gz" \
+			window_matrix "$refined" "${base}_WindowMatrix.tsv.gz" "$WINDOW"
+	fi
+
+	if [ -n "$FREQ_WINDOW" ]; then
+		start_stage "frequency${suffix}" "$refined_stage" "$refined" "${base}_AncestryFreq${EXT/csv/tsv}" \
+			ancestry_frequency "$refined" "${base}_AncestryFreq${EXT/csv/tsv}" "$FREQ_WINDOW"
+	fi
+
+	start_stage "paint${suffix}" "$refined_stage" "$refined" "$paint_plot" \
+		paint_genome "$refined" "$base" "$RENDER"
+}
+
+if [[ $CSIZE == *,* ]]; then
+	# Several cluster sizes: the comparison table is parsed once and every size is clustered in parallel,
+	# each size writing its own set of outputs named <basename>_c<size>_*
+	SIZES=$(echo "$CSIZE" | tr ',' '\n' | sort -n -u | tr '\n' ' ')
+	SWEEP_GZ=""
+	if [[ $EXT == .csv.gz ]]; then
+		SWEEP_GZ="-GZ"
+	fi
+	SWEEP_OUTPUTS="${output_file_base}_SweepSummary.csv"
+	for SIZE in $SIZES; do
+		SWEEP_OUTPUTS="$SWEEP_OUTPUTS ${output_file_base}_c${SIZE}_ClusteredRaw${EXT} ${output_file_base}_c${SIZE}_Clustered${EXT}"
+	done
+	start_stage sweep "compare" "$FILT1" "$SWEEP_OUTPUTS" \
+		sweep_clusters "$FILT1" "$output_file_base" "$CSIZE" "$SWEEP_GZ"
+
+	for SIZE in $SIZES; do
+		start_outputs "_c${SIZE}" sweep sweep "${output_file_base}_c${SIZE}" "$SIZE"
+	done
+elif [[ -n $HMM_RATE ]]; then
+	FILT3="${output_file_base}_ClusteredRaw${EXT}"
+	REFINE="${output_file_base}_Clustered${EXT}"
+
+	start_stage hmm "compare" "$FILT1" "$FILT3 $REFINE" \
+		hmm_ancestry "$FILT1" "$output_file_base" "$HMM_RATE" "$FILT3" "$REFINE"
+
+	start_outputs "" hmm hmm "$output_file_base" "$CSIZE"
+else
+	FILT3="${output_file_base}_ClusteredRaw${EXT}"
+	REFINE="${output_file_base}_Clustered${EXT}"
+	SEL=$((CSIZE * 10))
+
+	start_stage cluster "compare" "$FILT1" "$FILT3" \
+		cluster_snps "$FILT1" "$output_file_base" "$CSIZE" "$FILT3"
+	start_stage refine "cluster" "$FILT3" "$REFINE" \
+		refine_clusters "$FILT3" "$REFINE" "$SEL"
+
+	start_outputs "" cluster refine "$output_file_base" "$CSIZE"
+fi
+
+# Wait for every stage and report the failed ones
+FAILED=""
+for STAGE in "${!STAGE_PID[@]}"; do
+	wait_stage "$STAGE" || FAILED="$FAILED $STAGE"
+done
+
+if [[ -n $FAILED ]]; then
+	echo "Pipeline failed in stages:$FAILED"
+	exit 1
+fi
 
 echo "Pipeline completed"
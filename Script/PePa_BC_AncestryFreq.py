@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import csv
+import time
+import argparse
+from collections import defaultdict
+
+from PePa_BC_BGZF import open_table
+
+def read_events(input_file):
+    """
+    Reads the clustered segments as start and end events, grouped by chromosome.
+
+    A segment [Start, End] adds one carrier of its ancestry at Start and removes it at End + 1.
+
+    Parameters:
+        input_file (str): Path to the clustered file (Chromosome, Start, End, Ancestry, filename).
+
+    Returns:
+        events (dict): Mapping of chromosome -> list of (position, ancestry index, +1 or -1).
+        ancestries (list): Sorted list of the ancestries found in the file.
+        n_samples (int): Number of samples in the file.
+    """
+    events = defaultdict(list)
+    codes = {}
+    samples = set()
+
+    with open_table(input_file, 'r') as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        for row in reader:
+            code = codes.setdefault(row['Ancestry'], len(codes))
+            events[row['Chromosome']].append((int(row['Start']), code, 1))
+            events[row['Chromosome']].append((int(row['End']) + 1, code, -1))
+            samples.add(row['filename'])
+
+    # Number the ancestries in sorted order, so the columns do not depend on the order of the file
+    ancestries = sorted(codes)
+    order = {codes[ancestry]: i for i, ancestry in enumerate(ancestries)}
+    for chrom in events:
+        events[chrom] = [(pos, order[code], delta) for pos, code, delta in events[chrom]]
+
+    return events, ancestries, len(samples)
+
+def sweep(events, n_ancestries):
+    """
+    Sweeps the events of a chromosome once to build the step function of the carriers of each ancestry.
+
+    Sorting the events costs O(S log S) for S segments, and the sweep itself is linear. Consecutive
+    steps with the same counts are merged and positions covered by no segment are left out.
+
+    Parameters:
+        events (list): (position, ancestry index, +1 or -1) tuples of the chromosome.
+        n_ancestries (int): Number of ancestries.
+
+    Returns:
+        list: (start, end, counts) tuples, 1-based and inclusive, where counts is the tuple of the
+              number of samples carrying each ancestry over the step.
+    """
+    events.sort()
+    counts = [0] * n_ancestries
+    steps = []
+    i = 0
+    while i < len(events):
+        pos = events[i][0]
+        # Apply every event at this position before starting the next step
+        while i < len(events) and events[i][0] == pos:
+            counts[events[i][1]] += events[i][2]
+            i += 1
+        if i == len(events):
+            break
+        end = events[i][0] - 1
+        current = tuple(counts)
+        if not any(current):
+            continue
+        if steps and steps[-1][1] == pos - 1 and steps[-1][2] == current:
+            steps[-1] = (steps[-1][0], end, current)
+        else:
+            steps.append((pos, end, current))
+    return steps
+
+def bin_steps(steps, window, n_ancestries):
+    """
+    Averages a step function over fixed-size windows, weighting each step by the bp it covers in a window.
+
+    Parameters:
+        steps (list): Output of sweep for one chromosome.
+        window (int): Window size in bp.
+        n_ancestries (int): Number of ancestries.
+
+    Returns:
+        list: (start, end, mean counts) tuples for each window overlapped by a step.
+    """
+    sums = defaultdict(lambda: [0] * n_ancestries)
+    for start, end, counts in steps:
+        for index in range((start - 1) // window, (end - 1) // window + 1):
+            overlap = min(end, (index + 1) * window) - max(start, index * window + 1) + 1
+            total = sums[index]
+            for i, count in enumerate(counts):
+                total[i] += count * overlap
+
+    # Windows end at the last position covered by the track
+    last = steps[-1][1] if steps else 0
+    bins = []
+    for index in sorted(sums):
+        start = index * window + 1
+        end = min((index + 1) * window, last)
+        bins.append((start, end, tuple(total / (end - start + 1) for total in sums[index])))
+    return bins
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Computes how many samples carry each ancestry along each chromosome, to find segregation distortion.\n'
+                    'Each segment boundary of the clustered file becomes an event and each chromosome is swept once.\n'
+                    'The output is a step-function track (Chromosome, Start, End, Covered, then the number and the\n'
+                    'frequency of the samples carrying each ancestry), or the mean values in windows with -W.\n'
+                    'Frequencies are fractions of all the samples of the file, so samples without a segment at a\n'
+                    'position (Covered below the number of samples) do not inflate them.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-I', '--input', required=True,
+                        help='Path to the clustered file (eg. <basename>_Clustered.csv).')
+    parser.add_argument('-O', '--output', required=True,
+                        help='Path to the output track (eg. <basename>_AncestryFreq.tsv, bgzip-compressed if it ends in .gz).')
+    parser.add_argument('-W', '--window', type=int, default=0,
+                        help='Window size in bp to average the track in bins (eg. 10000, default: exact steps).')
+    args = parser.parse_args()
+
+    if args.window < 0:
+        parser.error("the window size must be a positive number of bp")
+
+    events, ancestries, n_samples = read_events(args.input)
+    n_ancestries = len(ancestries)
+
+    rows = 0
+    with open_table(args.output, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        writer.writerow(["Chromosome", "Start", "End", "Covered"] + ancestries + [f"{ancestry}_Freq" for ancestry in ancestries])
+        for chrom in sorted(events):
+            steps = sweep(events[chrom], n_ancestries)
+            if args.window:
+                steps = bin_steps(steps, args.window, n_ancestries)
+            for start, end, counts in steps:
+                covered = sum(counts)
+                values = ['%.4g' % count for count in counts] if args.window else list(counts)
+                writer.writerow([chrom, start, end, '%.4g' % covered if args.window else covered] + values +
+                                ['%.4g' % (count / n_samples) for count in counts])
+                rows += 1
+
+    print(f"Ancestry frequencies of {n_samples} samples in {rows} {'windows' if args.window else 'steps'} written in: '{args.output}'")
+
+if __name__ == '__main__':
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
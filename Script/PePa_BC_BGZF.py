@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import gzip
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+TABIX_MAGIC = b"TBI\x01"
+
+# Size of the windows of the tabix linear index (16 kb)
+LINEAR_SHIFT = 14
+
+# Uncompressed bytes per BGZF block (as bgzip), so a compressed block always fits in 64 kb
+BLOCK_SIZE = 0xff00
+
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def is_bgzf(path):
+    """Checks whether a file is BGZF-compressed (eg. written by bgzip), so it can be read from any block."""
+    with open(path, 'rb') as file:
+        header = file.read(18)
+    return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+def find_index(path):
+    """Returns the path to the tabix index of a file (<file>.tbi) if it exists and is usable, otherwise None."""
+    index_file = f"{path}.tbi"
+    if path.endswith('.gz') and os.path.exists(index_file) and is_bgzf(path):
+        return index_file
+    return None
+
+def read_tabix_index(index_file):
+    """
+    Reads a tabix index (.tbi).
+
+    Parameters:
+        index_file (str): Path to the index file.
+
+    Returns:
+        dict: Mapping of sequence name -> (bins, linear), where bins maps a bin number to its list of
+              (start, end) chunks as virtual offsets, and linear is the list of the smallest virtual
+              offset of the records overlapping each 16 kb window.
+    """
+    with gzip.open(index_file, 'rb') as file:
+        data = file.read()
+    if data[:4] != TABIX_MAGIC:
+        raise ValueError(f"'{index_file}' is not a tabix index file.")
+
+    n_ref = struct.unpack_from('<i', data, 4)[0]
+    names_length = struct.unpack_from('<i', data, 32)[0]
+    names = data[36:36 + names_length].split(b'\0')[:n_ref]
+    offset = 36 + names_length
+
+    index = {}
+    for name in names:
+        bins = {}
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        for _ in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            chunks = struct.unpack_from(f'<{2 * n_chunk}Q', data, offset)
+            offset += 16 * n_chunk
+            bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+        n_intv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        linear = list(struct.unpack_from(f'<{n_intv}Q', data, offset))
+        offset += 8 * n_intv
+        index[name.decode()] = (bins, linear)
+
+    return index
+
+def region_to_bins(start, end):
+    """Lists the bins of the binning scheme that may hold records overlapping [start, end) (0-based)."""
+    end -= 1
+    bins = [0]
+    for shift, first_bin in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(first_bin + (start >> shift), first_bin + (end >> shift) + 1))
+    return bins
+
+def region_offset(index, chrom, start, end):
+    """
+    Finds the virtual offset from which to read the records of a region.
+
+    Records of the region are found by reading on from this offset until a record of another
+    sequence or past the end of the region is reached, as the indexed file is sorted.
+
+    Parameters:
+        index (dict): Tabix index, as returned by read_tabix_index.
+        chrom (str): Sequence name.
+        start (int): Start of the region (1-based, inclusive).
+        end (int): End of the region (1-based, inclusive), or None for the end of the sequence.
+
+    Returns:
+        int: The virtual offset, or None if no record can overlap the region.
+    """
+    if chrom not in index:
+        return None
+    bins, linear = index[chrom]
+    start = max(0, start - 1)
+    end = end if end is not None else 1 << 29
+
+    # Records overlapping the region cannot start before the linear index entry of its first window
+    window = start >> LINEAR_SHIFT
+    min_offset = linear[min(window, len(linear) - 1)] if linear else 0
+
+    chunks = [chunk for bin_number in region_to_bins(start, end) for chunk in bins.get(bin_number, [])
+              if chunk[1] > min_offset]
+    if not chunks:
+        return None
+    return max(min_offset, min(chunk_start for chunk_start, _ in chunks))
+
+def read_blocks(file):
+    """Yields the decompressed content of each BGZF block, from the current position of the file."""
+    while True:
+        header = file.read(12)
+        if len(header) < 12:
+            return
+        if header[:4] != BGZF_MAGIC:
+            raise ValueError(f"'{file.name}' is not BGZF-compressed.")
+        extra_length = struct.unpack_from('<H', header, 10)[0]
+        extra = file.read(extra_length)
+
+        # The total size of the block is stored in the BC subfield of the extra field
+        block_size = None
+        i = 0
+        while i + 4 <= extra_length:
+            subfield_length = struct.unpack_from('<H', extra, i + 2)[0]
+            if extra[i:i + 2] == b"BC":
+                block_size = struct.unpack_from('<H', extra, i + 4)[0] + 1
+            i += 4 + subfield_length
+        if block_size is None:
+            raise ValueError(f"'{file.name}' is not BGZF-compressed.")
+
+        # Raw deflate data, followed by the CRC32 and the uncompressed size
+        deflated = file.read(block_size - 12 - extra_length)
+        yield zlib.decompress(deflated[:-8], -15)
+
+def bgzf_lines(path, virtual_offset=0):
+    """
+    Yields the lines of a BGZF-compressed file, starting at a virtual offset.
+
+    Parameters:
+        path (str): Path to the BGZF-compressed file.
+        virtual_offset (int): Offset of the compressed block (upper 48 bits) and offset of the
+                              first line within its uncompressed content (lower 16 bits).
+    """
+    with open(path, 'rb') as file:
+        file.seek(virtual_offset >> 16)
+        skip = virtual_offset & 0xFFFF
+        remainder = b""
+        for block in read_blocks(file):
+            if skip:
+                block = block[skip:]
+                skip = 0
+            lines = (remainder + block).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                yield line.decode() + "\n"
+        if remainder:
+            yield remainder.decode()
+
+def compress_block(data, level=6):
+    """Compresses up to BLOCK_SIZE bytes into one BGZF block (a gzip member recording its own size)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+class BGZFWriter(io.BufferedIOBase):
+    """
+    Binary file writing BGZF blocks compressed in parallel.
+
+    Blocks are independent, so they are compressed by a pool of threads (zlib releases the GIL) and
+    written in order; the output is readable by gzip, bgzip, tabix and R like any bgzipped file.
+    """
+
+    def __init__(self, path, threads=None, level=6):
+        super().__init__()
+        self.file = open(path, 'wb')
+        self.level = level
+        self.buffer = bytearray()
+        threads = threads or max(1, os.cpu_count()//2)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = deque()
+        # Bound the blocks waiting to be written, so memory does not grow with the file
+        self.max_pending = 4 * threads
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(compress_block, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            self.file.write(EOF_BLOCK)
+        finally:
+            self.executor.shutdown()
+            self.file.close()
+            super().close()
+
+def open_table(path, mode='r', newline=None, threads=None):
+    """
+    Opens a table as text, compressed or not.
+
+    For reading, gzip and bgzip-compressed files are detected from their content and decompressed
+    transparently. For writing, files named *.gz are bgzip-compressed with multithreaded block
+    compression, other files are written as plain text.
+
+    Parameters:
+        path (str): Path to the table.
+        mode (str): 'r' to read, 'w' to write.
+        newline (str): As for open (use '' with the csv module).
+        threads (int): Number of compression threads (default: half the CPUs).
+    """
+    if 'r' in mode:
+        with open(path, 'rb') as file:
+            compressed = file.read(2) == b"\x1f\x8b"
+        if compressed:
+            return gzip.open(path, 'rt', newline=newline)
+        return open(path, 'r', newline=newline)
+
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(BGZFWriter(path, threads), encoding='utf-8', newline=newline)
+    return open(path, 'w', newline=newline)
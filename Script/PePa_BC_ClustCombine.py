@@ -4,7 +4,9 @@ import os
 import argparse
 import time
 
-def combine_csv_files(suffix, output_file):
+from PePa_BC_BGZF import open_table
+
+def combine_csv_files(suffix, output_file, normalise=False):
     # Find all CSV files that contain the provided suffix anywhere in the filename before '.csv'
     csv_files = [file for file in os.listdir() if suffix in file and file.endswith('.csv')]
 
@@ -13,34 +15,35 @@ def combine_csv_files(suffix, output_file):
         print(f"No CSV files with '{suffix}' suffix found.")
         return
 
-    # Open the output file in write mode
-    with open(output_file, 'w') as outfile:
+    # Open the output file in write mode (bgzip-compressed if it ends in .gz)
+    with open_table(output_file, 'w') as outfile:
         first_file = True
 
         for file in csv_files:
             print(f"Combining file: {file}")
+            # With normalise, the Individual is named after the file without the suffix and extension (eg. <basename>1)
+            name = file.replace(f"{suffix}Individual", "")[:-len('.csv')] if normalise else file
             with open(file, 'r') as infile:
                 header = infile.readline().strip()  # Read the header
                 if first_file:
                     # Write header with additional column for file name
                     outfile.write(f"{header}\tfilename\n")
                     first_file = False
-                else:
-                    # Skip the header for subsequent files
-                    infile.readline()
+                # The header of subsequent files is skipped (it was already read above)
                 
                 # Write the rest of the file content with additional column for file name
                 for line in infile:
-                    outfile.write(f"{line.strip()}\t{file}\n")
+                    outfile.write(f"{line.strip()}\t{name}\n")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Combine CSV files with a specified suffix into one file.")
     parser.add_argument('-S', '--suffix', required=True, help="The suffix for the CSV files to combine.")
-    parser.add_argument('-o', '--output', required=True, help="The name of the output CSV file.")
+    parser.add_argument('-o', '--output', required=True, help="The name of the output CSV file (bgzip-compressed if it ends in .gz).")
+    parser.add_argument('-n', '--normalise', action='store_true', help="Name the Individuals after the files without '<suffix>Individual' and '.csv'.")
     args = parser.parse_args()
     # Record the start time for measuring execution duration
     start_time = time.time()
-    combine_csv_files(args.suffix, args.output)
+    combine_csv_files(args.suffix, args.output, args.normalise)
     # Record the end time and calculate elapsed time
     end_time = time.time()
     elapsed_time = end_time - start_time  # Time taken in seconds
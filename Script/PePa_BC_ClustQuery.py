@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from PePa_BC_BGZF import open_table
+
+MAGIC = b"PEPAIDX1"
+
+def build_index(input_file, index_file):
+    """
+    Builds a sorted interval index per (sample, chromosome) from a clustered file and saves it.
+
+    The index file holds a JSON header (samples, chromosomes, ancestries and the offset and count of
+    the segments of each sample and chromosome) followed by three flat arrays: starts and ends as
+    64-bit integers and ancestry codes as 32-bit integers. The arrays are memory-mapped when queried.
+
+    Parameters:
+        input_file (str): Path to the clustered file (Chromosome, Start, End, Ancestry, filename).
+        index_file (str): Path to the index file to write.
+    """
+    groups = defaultdict(list)
+    ancestries = {}
+
+    with open_table(input_file, 'r') as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        for row in reader:
+            code = ancestries.setdefault(row['Ancestry'], len(ancestries))
+            groups[(row['filename'], row['Chromosome'])].append((int(row['Start']), int(row['End']), code))
+
+    starts = array('q')
+    ends = array('q')
+    codes = array('i')
+    keys = []
+    for (sample, chrom) in sorted(groups):
+        segments = sorted(groups[(sample, chrom)])
+        keys.append([sample, chrom, len(starts), len(segments)])
+        for start, end, code in segments:
+            starts.append(start)
+            ends.append(end)
+            codes.append(code)
+
+    stat = os.stat(input_file)
+    header = json.dumps({
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "ancestries": sorted(ancestries, key=ancestries.get),
+        "keys": keys,
+        "n_segments": len(starts),
+    }).encode()
+    # Pad the header so the arrays are 8-byte aligned in the file
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wb') as out:
+        out.write(MAGIC)
+        out.write(struct.pack('<Q', len(header)))
+        out.write(header)
+        for values in (starts, ends, codes):
+            if sys.byteorder != 'little':
+                values.byteswap()
+            values.tofile(out)
+    os.replace(temp_file, index_file)
+
+    print(f"Index of {len(starts)} segments in {len(keys)} sample/chromosome pairs written in: '{index_file}'", file=sys.stderr)
+
+class ClusterIndex:
+    """
+    Memory-mapped interval index over a clustered file.
+
+    Segments of a sample on a chromosome do not overlap (as produced by ClusterClusters), so both their
+    starts and their ends are sorted and every lookup is a binary search.
+    """
+
+    def __init__(self, index_file):
+        self.file = open(index_file, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{index_file}' is not a PePa index file.")
+
+        header_length = struct.unpack_from('<Q', self.map, len(MAGIC))[0]
+        offset = len(MAGIC) + 8
+        self.header = json.loads(self.map[offset:offset + header_length])
+        offset += header_length
+
+        n = self.header["n_segments"]
+        view = memoryview(self.map)
+        self.starts = view[offset:offset + 8 * n].cast('q')
+        self.ends = view[offset + 8 * n:offset + 16 * n].cast('q')
+        self.codes = view[offset + 16 * n:offset + 20 * n].cast('i')
+
+        self.ancestries = self.header["ancestries"]
+        self.ranges = {(sample, chrom): (first, first + count) for sample, chrom, first, count in self.header["keys"]}
+        self.samples = sorted({sample for sample, _ in self.ranges})
+
+    def is_current(self, input_file):
+        """Checks that the index was built from the current version of the clustered file."""
+        stat = os.stat(input_file)
+        return stat.st_size == self.header["source_size"] and stat.st_mtime == self.header["source_mtime"]
+
+    def close(self):
+        self.starts.release()
+        self.ends.release()
+        self.codes.release()
+        self.map.close()
+        self.file.close()
+
+    def point(self, sample, chrom, position):
+        """
+        Returns the segment (start, end, ancestry) of a sample covering a position, or None.
+        """
+        first, last = self.ranges.get((sample, chrom), (0, 0))
+        i = bisect_right(self.starts, position, first, last) - 1
+        if i >= first and self.ends[i] >= position:
+            return self.starts[i], self.ends[i], self.ancestries[self.codes[i]]
+        return None
+
+    def region(self, sample, chrom, start, end):
+        """
+        Yields the segments (start, end, ancestry) of a sample overlapping a region, clipped to the region.
+        """
+        first, last = self.ranges.get((sample, chrom), (0, 0))
+        lo = bisect_left(self.ends, start, first, last)
+        hi = bisect_right(self.starts, end, first, last)
+        for i in range(lo, hi):
+            yield max(self.starts[i], start), min(self.ends[i], end), self.ancestries[self.codes[i]]
+
+def open_index(input_file, index_file=None):
+    """
+    Opens the index of a clustered file, building it first if it is missing or out of date.
+    """
+    index_file = index_file or f"{input_file}.idx"
+    if not os.path.exists(index_file):
+        build_index(input_file, index_file)
+        return ClusterIndex(index_file)
+
+    index = ClusterIndex(index_file)
+    if not index.is_current(input_file):
+        index.close()
+        build_index(input_file, index_file)
+        index = ClusterIndex(index_file)
+    return index
+
+def parse_locus(text):
+    """
+    Parses 'Chr:Pos', 'Chr:Start-End' or whitespace-separated 'Chr Pos [End]' into (chrom, start, end).
+    Commas in numbers are allowed (eg. Chr2:1,234,567).
+    """
+    match = re.fullmatch(r'\s*(\S+?)(?::|\s+)([\d,]+)(?:(?:-|\s+)([\d,]+))?\s*', text)
+    if not match:
+        raise ValueError(f"Cannot parse the locus '{text.strip()}' (expected Chr:Pos or Chr:Start-End).")
+    chrom, start, end = match.groups()
+    start = int(start.replace(',', ''))
+    end = int(end.replace(',', '')) if end else None
+    return chrom, start, end
+
+def query_point(index, writer, query, chrom, position, samples):
+    for sample in samples:
+        segment = index.point(sample, chrom, position)
+        if segment:
+            writer.writerow([query, sample, chrom, position, position, segment[2], segment[0], segment[1], 1])
+        else:
+            writer.writerow([query, sample, chrom, position, position, "NA", "NA", "NA", 0])
+
+def query_region(index, writer, query, chrom, start, end, samples, ancestry, min_fraction):
+    length = end - start + 1
+    for sample in samples:
+        # Sum the bp covered by each ancestry within the region
+        covered = defaultdict(int)
+        for segment_start, segment_end, segment_ancestry in index.region(sample, chrom, start, end):
+            covered[segment_ancestry] += segment_end - segment_start + 1
+        for segment_ancestry in sorted(covered):
+            fraction = covered[segment_ancestry] / length
+            if ancestry and segment_ancestry != ancestry:
+                continue
+            if fraction < min_fraction:
+                continue
+            writer.writerow([query, sample, chrom, start, end, segment_ancestry, "NA", "NA", '%.4g' % fraction])
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Queries the ancestry of samples at positions or regions of a clustered file through a persistent index.\n"
+                    "The index (<input>.idx by default) is built on first use and rebuilt when the clustered file changes.\n\n"
+                    "Output columns: Query, Sample, Chromosome, Start, End, Ancestry, SegmentStart, SegmentEnd, Fraction\n"
+                    "(SegmentStart/SegmentEnd are given for point queries, Fraction is the share of the region covered).",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-I', '--input', required=True, help="Path to the clustered file (eg. <basename>_Clustered.csv).")
+    parser.add_argument('-X', '--index', help="Path to the index file (default: <input>.idx).")
+    parser.add_argument('-p', '--point', help="Position to query, eg. Chr2:1,234,567.")
+    parser.add_argument('-r', '--region', help="Region to query, eg. Chr2:1000000-2000000.")
+    parser.add_argument('-P', '--positions', help="File with one query per line (Chr:Pos, Chr:Start-End, or Chr Pos [End]).")
+    parser.add_argument('-s', '--samples', nargs='+', help="Samples to query (default: all samples).")
+    parser.add_argument('-a', '--ancestry', help="Only report this ancestry in region queries (eg. Ancestry1).")
+    parser.add_argument('-f', '--min-fraction', type=float, default=0.0,
+                        help="Only report ancestries covering at least this fraction of a region (default: 0, use 1 for the whole region).")
+    parser.add_argument('-O', '--output', help="Path to the output file (default: standard output).")
+    args = parser.parse_args()
+
+    index = open_index(args.input, args.index)
+
+    queries = []
+    if args.point:
+        queries.append(args.point)
+    if args.region:
+        queries.append(args.region)
+    if args.positions:
+        with open(args.positions, 'r') as file:
+            queries.extend(line for line in file if line.strip() and not line.startswith('#'))
+
+    samples = args.samples or index.samples
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        writer.writerow(["Query", "Sample", "Chromosome", "Start", "End", "Ancestry", "SegmentStart", "SegmentEnd", "Fraction"])
+        for query in queries:
+            try:
+                chrom, start, end = parse_locus(query)
+            except ValueError as error:
+                print(f"Error: {error}", file=sys.stderr)
+                sys.exit(1)
+            query = query.strip()
+            if end is None:
+                query_point(index, writer, query, chrom, start, samples)
+            else:
+                query_region(index, writer, query, chrom, start, end, samples, args.ancestry, args.min_fraction)
+    finally:
+        if args.output:
+            out.close()
+        index.close()
+
+if __name__ == '__main__':
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds", file=sys.stderr)
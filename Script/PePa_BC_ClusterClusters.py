@@ -3,6 +3,8 @@
 import sys
 import argparse
 
+from PePa_BC_BGZF import open_table
+
 def parse_arguments():
     """
     Parses command-line arguments provided by the user.
@@ -38,7 +40,7 @@ def read_input_file(input_file):
     clusters = []
 
     try:
-        with open(input_file, 'r') as file:
+        with open_table(input_file, 'r') as file:
             # Read the header line and split into column names
             header_line = file.readline().strip()
             header = header_line.split('\t')
@@ -160,7 +162,7 @@ def write_output(combined_clusters, output_file):
         output_file (str): Path to the output file.
     """
     try:
-        with open(output_file, 'w') as file:
+        with open_table(output_file, 'w') as file:
             # Write the header
             file.write('Chromosome\tStart\tEnd\tAncestry\tfilename\n')
 
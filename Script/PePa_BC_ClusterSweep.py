@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import time
+import argparse
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+
+from PePa_BC_ClusteringSNPs import read_sorted, cluster_column
+from PePa_BC_ClusterClusters import combine_clusters, write_output
+from PePa_BC_BGZF import open_table
+
+# Sorted comparison table shared with the worker processes
+_table = None
+
+def init_worker(num_columns, data):
+    global _table
+    _table = (num_columns, data)
+
+def run_size(cluster_size, output_file_base, masks, extension='.csv'):
+    """
+    Clusters every Individual of the shared table with one cluster size and refines the clusters.
+
+    Writes <base>_c<size>_ClusteredRaw.csv and <base>_c<size>_Clustered.csv, with the same
+    Individual names as a single pipeline run (<base>1, <base>2, ...). Outputs are bgzip-compressed
+    when the extension ends in .gz.
+
+    Returns:
+        dict: Summary of the segments obtained with this cluster size.
+    """
+    num_columns, data = _table
+    size_base = f"{output_file_base}_c{cluster_size}"
+    threshold = cluster_size * 10
+
+    clusters = []
+    for name, col in enumerate(range(2, num_columns), start=1):
+        filename = f"{output_file_base}{name}"
+        for chrom, start, end, ancestry in cluster_column(data, col, cluster_size, masks):
+            clusters.append({'Chromosome': chrom, 'Start': start, 'End': end, 'Ancestry': ancestry,
+                             'filename': filename, 'Length': end - start})
+
+    with open_table(f"{size_base}_ClusteredRaw{extension}", 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(["Chromosome", "Start", "End", "Ancestry", "filename"])
+        writer.writerows([c['Chromosome'], c['Start'], c['End'], c['Ancestry'], c['filename']] for c in clusters)
+    raw_segments = len(clusters)
+
+    combined = combine_clusters(clusters, threshold)
+    write_output(combined, f"{size_base}_Clustered{extension}")
+
+    lengths = [c['End'] - c['Start'] + 1 for c in combined]
+    return {
+        'ClusterSize': cluster_size,
+        'Threshold': threshold,
+        'RawSegments': raw_segments,
+        'Segments': len(combined),
+        'SegmentsPerIndividual': round(len(combined) / max(1, num_columns - 2), 2),
+        'MeanLength': round(statistics.mean(lengths), 1) if lengths else 0,
+        'MedianLength': statistics.median(lengths) if lengths else 0,
+        'MinLength': min(lengths, default=0),
+        'MaxLength': max(lengths, default=0),
+        'TotalBP': sum(lengths),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Clusters a comparison table with several cluster sizes, parsing the table only once.\n'
+                    'For each size S, writes <base>_cS_ClusteredRaw.csv and <base>_cS_Clustered.csv (refined ignoring clusters shorter than S*10),\n'
+                    'and a summary of the segments obtained with each size in <base>_SweepSummary.csv.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('input_file', help='Path to the comparison table (eg. <basename>_Transformed.csv)')
+    parser.add_argument('output_file_base', help='Base name for the output files')
+    parser.add_argument('-CLUSTER', required=True, help='Comma-separated sizes of the clusters (eg. 10,50,100)')
+    parser.add_argument('-MASK', action='store_true', help='Input holds founder bitmasks (ComparisonTable -m) instead of labels')
+    parser.add_argument('-GZ', action='store_true', help='Write bgzip-compressed clusters (<base>_cS_ClusteredRaw.csv.gz and <base>_cS_Clustered.csv.gz)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of parallel processes (default: one per size, up to half the CPUs)')
+    args = parser.parse_args()
+
+    try:
+        sizes = sorted({int(size) for size in args.CLUSTER.split(',') if size.strip()})
+    except ValueError:
+        parser.error(f"invalid cluster sizes '{args.CLUSTER}'")
+
+    # Parse and sort the table once; each worker receives it a single time
+    num_columns, data = read_sorted(args.input_file)
+    print(f"Table of {len(data)} SNPs and {num_columns - 2} Individuals read, clustering with sizes: {' '.join(map(str, sizes))}")
+
+    max_workers = args.workers or min(len(sizes), max(1, os.cpu_count()//2))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(num_columns, data)) as executor:
+        futures = [executor.submit(run_size, size, args.output_file_base, args.MASK, '.csv.gz' if args.GZ else '.csv') for size in sizes]
+        summary = [future.result() for future in futures]
+
+    summary_file = f"{args.output_file_base}_SweepSummary.csv"
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(summary[0].keys()), delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(summary)
+    print(f"Summary of the cluster sizes written in: '{summary_file}'")
+
+if __name__ == "__main__":
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
@@ -2,34 +2,103 @@
 
 import csv
 import sys
-import tempfile
-import os
 import argparse
 import time
 
-def main(input_file, output_file_base, cluster_size):
+from PePa_BC_BGZF import open_table
+
+def mask_label(mask):
+    """
+    Converts a founder bitmask into an ancestry label (e.g. 5 -> 'Ancestry1+Ancestry3', 0 -> 'Unknown').
+    """
+    if not mask:
+        return "Unknown"
+    return "+".join(f"Ancestry{bit + 1}" for bit in range(mask.bit_length()) if mask >> bit & 1)
+
+def compatible(prev_ancestry, ancestry, masks):
+    """
+    Checks whether a SNP can extend the current cluster.
+
+    Labels must be identical (Het SNPs of genotype tables cluster together). Founder bitmasks only need to share at least one founder,
+    while Unknown sites (mask 0) only cluster with each other.
+    """
+    if masks and prev_ancestry and ancestry:
+        return bool(prev_ancestry & ancestry)
+    return prev_ancestry == ancestry
+
+def read_sorted(input_file):
+    """
+    Reads a comparison table and sorts its rows by chromosome and position.
+
+    Values are interned, so the few labels (Ancestry1, Ancestry2, Het, Unknown) repeated in every
+    cell of the table are stored once instead of once per cell.
+
+    Returns:
+        num_columns (int): Number of columns of the table.
+        data (list): Sorted rows, without the header.
+    """
+    with open_table(input_file, 'r') as f:
+        reader = csv.reader(f, delimiter='\t')
+        headers = next(reader, None)
+        num_columns = len(headers)
+
+        # Sort the data by columns 1 and 2
+        data = sorted((list(map(sys.intern, row)) for row in reader), key=lambda row: (row[0], int(row[1])))
+
+    return num_columns, data
+
+def cluster_column(data, col, cluster_size, masks=False):
+    """
+    Groups consecutive SNPs of one Individual with the same (or compatible) ancestry into clusters.
+
+    Parameters:
+        data (list): Rows sorted by chromosome and position.
+        col (int): Index of the column of the Individual.
+        cluster_size (int): Minimum size (bp) of the clusters to keep.
+        masks (bool): Whether the column holds founder bitmasks instead of labels.
+
+    Returns:
+        list: Clusters as [chromosome, start, end, ancestry].
+    """
+    # Initialize variables
+    prev_chrom = None
+    prev_ancestry = None
+    start = None
+    end = None
+    result = []
+
+    # Process the data
+    for row in data:
+        chrom, pos, ancestry = row[0], int(row[1]), row[col]
+        if masks:
+            ancestry = int(ancestry)
+
+        if prev_chrom == chrom and compatible(prev_ancestry, ancestry, masks):
+            end = pos  # Update end position for the current cluster
+            if masks:
+                prev_ancestry &= ancestry  # Keep only the founders compatible with every SNP
+        else:
+            if prev_chrom is not None and end - start + 1 >= cluster_size:
+                result.append([prev_chrom, start, end, mask_label(prev_ancestry) if masks else prev_ancestry])
+            start = pos  # Start a new cluster
+            end = pos
+            prev_chrom = chrom
+            prev_ancestry = ancestry
+
+    # Add the last cluster if valid
+    if prev_chrom is not None and end - start + 1 >= cluster_size:
+        result.append([prev_chrom, start, end, mask_label(prev_ancestry) if masks else prev_ancestry])
+
+    return result
+
+def main(input_file, output_file_base, cluster_size, masks=False):
     # Check if the input and output file names are provided
     if not input_file or not output_file_base:
         print("Usage: script.py input_file output_file_base -CLUSTER cluster_size")
         sys.exit(1)
 
-    # Create a temporary file for sorted data
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', newline='') as temp_file:
-        temp_file_name = temp_file.name
-
     # Read the input file and determine the number of columns
-    with open(input_file, 'r') as f:
-        reader = csv.reader(f, delimiter='\t')
-        headers = next(reader, None)
-        num_columns = len(headers)
-        
-        # Sort the data by columns 1 and 2
-        data = sorted(reader, key=lambda row: (row[0], int(row[1])))
-
-    # Write sorted data to the temporary file
-    with open(temp_file_name, 'w', newline='') as f:
-        writer = csv.writer(f, delimiter='\t')
-        writer.writerows(data)
+    num_columns, data = read_sorted(input_file)
 
     name = 1
 
@@ -38,35 +107,7 @@ def main(input_file, output_file_base, cluster_size):
         output_file = f"{output_file_base}_CLUST_Individual{name}.csv"
         name += 1
 
-        # Read the sorted data from the temporary file
-        with open(temp_file_name, 'r') as f:
-            reader = csv.reader(f, delimiter='\t')
-            next(reader, None)  # Skip header
-            
-            # Initialize variables
-            prev_chrom = None
-            prev_ancestry = None
-            start = None
-            end = None
-            result = []
-
-            # Process the data
-            for row in reader:
-                chrom, pos, ancestry = row[0], int(row[1]), row[col]
-
-                if prev_chrom == chrom and prev_ancestry == ancestry:
-                    end = pos  # Update end position for the current cluster
-                else:
-                    if prev_chrom is not None and end - start + 1 >= cluster_size:
-                        result.append([prev_chrom, start, end, prev_ancestry])
-                    start = pos  # Start a new cluster
-                    end = pos
-                    prev_chrom = chrom
-                    prev_ancestry = ancestry
-
-            # Add the last cluster if valid
-            if prev_chrom is not None and end - start + 1 >= cluster_size:
-                result.append([prev_chrom, start, end, prev_ancestry])
+        result = cluster_column(data, col, cluster_size, masks)
 
         # Write results to output file
         with open(output_file, 'w', newline='') as f:
@@ -74,9 +115,6 @@ def main(input_file, output_file_base, cluster_size):
             writer.writerow(["Chromosome", "Start", "End", "Ancestry"])
             writer.writerows(result)
 
-    # Clean up the temporary file
-    os.remove(temp_file_name)
-
     print(f"Clustering performed for Individuals in {name - 1} columns")
 
 if __name__ == "__main__":
@@ -84,12 +122,13 @@ if __name__ == "__main__":
     parser.add_argument('input_file', help='Path to the input file')
     parser.add_argument('output_file_base', help='Base name for the output files')
     parser.add_argument('-CLUSTER', type=int, required=True, help='Size of the clusters')
+    parser.add_argument('-MASK', action='store_true', help='Input holds founder bitmasks (ComparisonTable -m) instead of labels')
     # Record the start time for measuring execution duration
     start_time = time.time()
     
     args = parser.parse_args()
 
-    main(args.input_file, args.output_file_base, args.CLUSTER)
+    main(args.input_file, args.output_file_base, args.CLUSTER, args.MASK)
     # Record the end time and calculate elapsed time
     end_time = time.time()
     elapsed_time = end_time - start_time  # Time taken in seconds
@@ -1,11 +1,49 @@
 #!/usr/bin/env python3
 
 import csv
+import sys
 import argparse
-import tempfile
-import shutil
 import os
 import time
+from itertools import repeat
+from operator import itemgetter
+
+from PePa_BC_BGZF import open_table
+from PePa_BC_Genotypes import bit_planes, classify, class_labels
+
+# Labels used when exactly two comparison columns are given
+LABELS = {0: "Unknown", 1: "Ancestry1", 2: "Ancestry2", 3: "BOTH"}
+
+def founder_masks(founder_values):
+    """
+    Builds a lookup from each allele carried by the founders to the bitmask of founders carrying it.
+
+    Bit i of a mask is set when the founder in the i-th comparison column carries the allele,
+    so a sample allele is classified with a single lookup whatever the number of founders.
+
+    Args:
+        founder_values (list): Alleles of the founders at one site, in comparison column order.
+
+    Returns:
+        dict: Mapping of allele to founder bitmask.
+    """
+    masks = {}
+    for bit, value in enumerate(founder_values):
+        masks[value] = masks.get(value, 0) | (1 << bit)
+    return masks
+
+def column_getter(columns):
+    """
+    Builds a function returning the values of the given columns of a row as a tuple, so the columns of a
+    row are taken in a single call instead of one index per column.
+
+    Args:
+        columns (list): 1-based column indices.
+    """
+    if not columns:
+        return lambda row: ()
+    getter = itemgetter(*(i - 1 for i in columns))
+    return getter if len(columns) > 1 else lambda row: (getter(row),)
 
 def parse_args():
     """
@@ -19,24 +57,39 @@ def parse_args():
         formatter_class=argparse.RawTextHelpFormatter
     )
     
-    parser.add_argument('-i', '--input', required=True, help='Input file name (tab-delimited).')
-    parser.add_argument('-o', '--output', required=True, help='Base output file name (without extension). The script appends "_Transformed.csv".')
+    parser.add_argument('-i', '--input', required=True, help='Input file name (tab-delimited, optionally gzip-compressed).')
+    parser.add_argument('-o', '--output', required=True, help='Output file name (bgzip-compressed if it ends in .gz).')
     parser.add_argument('-p', '--print_columns', required=True, 
                         help='Columns to print (1-based index). Provide as space-separated values, e.g., "1 2".')
     parser.add_argument('-t', '--target_columns', required=True, 
                         help='Target columns for comparison (1-based index). Provide as space-separated values, e.g., "3 4".')
     parser.add_argument('-c', '--compare_columns', required=True, 
-                        help='Comparison columns (1-based index) for determining categories. Provide exactly two space-separated values, e.g., "7 8".')
+                        help='Comparison columns (1-based index) for determining categories, one per founder. Provide at least two space-separated values, e.g., "7 8".')
+    parser.add_argument('-b', '--drop_both', action='store_true',
+                        help='Drop the SNPs where a target matches all the founders (BOTH), as the pipeline does.')
+    parser.add_argument('-m', '--mask', action='store_true',
+                        help='Write the bitmask of matching founders instead of labels (always on with more than two comparison columns).\n'
+                             'Sites where all founders carry the same allele are dropped in this mode.')
+    parser.add_argument('-g', '--genotypes', action='store_true',
+                        help='Input is a genotype table (VCFtoTable -GENOTYPES): samples are classified as Ancestry1, Ancestry2,\n'
+                             'Het or Unknown (missing call) with bitwise operations on their 2-bit genotypes.\n'
+                             'Needs two comparison columns; sites where the founders are not opposite homozygotes are dropped.')
     
     return parser.parse_args()
 
 def main():
     args = parse_args()
 
-    # Validate that exactly two comparison columns are provided
+    # Validate that at least two comparison columns are provided
     compare_columns = list(map(int, args.compare_columns.split()))
-    if len(compare_columns) != 2:
-        print("Error: -c should specify exactly two columns.")
+    if len(compare_columns) < 2:
+        print("Error: -c should specify at least two columns.")
+        sys.exit(1)
+
+    # Labels cannot describe sets of more than two founders, so bitmasks are written instead
+    write_masks = args.mask or len(compare_columns) > 2
+    if args.genotypes and write_masks:
+        print("Error: -g needs exactly two comparison columns and cannot be used with -m.")
         sys.exit(1)
 
     target_columns = list(map(int, args.target_columns.split()))
@@ -45,14 +98,13 @@ def main():
     output_file = f"{args.output}"
 
     # Extract the input file name without extension for dynamic column naming
-    input_file_name = os.path.splitext(os.path.basename(args.input))[0]
-
-    # Create a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', newline='') as temp_file:
-        temp_file_name = temp_file.name
+    input_file_name = os.path.basename(args.input)
+    if input_file_name.endswith('.gz'):
+        input_file_name = input_file_name[:-3]
+    input_file_name = os.path.splitext(input_file_name)[0]
 
-    # Read and process the input file
-    with open(args.input, 'r') as infile, open(temp_file_name, 'w', newline='') as outfile:
+    # Read and process the input file, writing the output in a single pass
+    with open_table(args.input, 'r', newline='') as infile, open_table(output_file, 'w', newline='') as outfile:
         reader = csv.reader(infile, delimiter='\t')
         writer = csv.writer(outfile, delimiter='\t')
 
@@ -63,33 +115,37 @@ def main():
             target_headers = [f"{input_file_name}_{i}" for i in target_columns]
             writer.writerow(selected_headers + target_headers)
 
+            get_selected = column_getter(print_columns)
+            get_targets = column_getter(target_columns)
+            get_founders = column_getter(compare_columns)
+
             for row in reader:
                 # Extract selected columns
-                selected_values = [row[i - 1] for i in print_columns]
-                
-                # Initialize output for categories of each target column
-                output = []
-
-                for target_column in target_columns:
-                    target_value = row[target_column - 1]
-                    compare1_value = row[compare_columns[0] - 1]
-                    compare2_value = row[compare_columns[1] - 1]
-                    
-                    # Determine the category for this target column comparison
-                    if target_value == compare1_value and target_value == compare2_value:
-                        output.append("BOTH")
-                    elif target_value == compare1_value:
-                        output.append("Ancestry1")
-                    elif target_value == compare2_value:
-                        output.append("Ancestry2")
-                    else:
-                        output.append("Unknown")
-                
-                writer.writerow(selected_values + output)
+                selected_values = list(get_selected(row))
+
+                if args.genotypes:
+                    # All the samples of the site are classified at once on the bit planes of their genotypes
+                    founder1, founder2 = get_founders(row)
+                    planes = classify(*bit_planes("".join(get_targets(row))), int(founder1), int(founder2), len(target_columns))
+                    if planes is None:
+                        continue  # The founders are not opposite homozygotes, the site is uninformative
+                    writer.writerow(selected_values + class_labels(*planes, len(target_columns)))
+                    continue
 
-    # Copy the temporary file to the final output file and then remove the temporary file
-    shutil.copy(temp_file_name, output_file)
-    os.remove(temp_file_name)
+                # Map each founder allele to the founders carrying it (or directly to its label), built once
+                # per site, then look up each target in it (alleles absent from the founders match none)
+                masks = founder_masks(get_founders(row))
+                if write_masks:
+                    if len(masks) == 1:
+                        continue  # All founders carry the same allele, the site is uninformative
+                    output = list(map(masks.get, get_targets(row), repeat(0)))
+                else:
+                    labels = {allele: LABELS[mask] for allele, mask in masks.items()}
+                    output = list(map(labels.get, get_targets(row), repeat("Unknown")))
+                    if args.drop_both and "BOTH" in output:
+                        continue
+
+                writer.writerow(selected_values + output)
 
 if __name__ == "__main__":
     # Record the start time for measuring execution duration
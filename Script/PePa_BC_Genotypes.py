@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# 2-bit genotype codes, as written in genotype tables (VCFtoTable -GENOTYPES)
+HOM_REF, HET, HOM_ALT, MISSING = 0, 1, 2, 3
+
+# Classes of a sample at a site where the founders are opposite homozygotes. With the first founder
+# homozygous for the reference allele the classes have the same codes as the genotypes.
+CLASS_LABELS = ("Ancestry1", "Het", "Ancestry2", "Unknown")
+
+# Digits of the 4 genotype codes packed in each byte value, lowest bits first
+BYTE_CODES = ["".join(str(value >> shift & 3) for shift in (0, 2, 4, 6)) for value in range(256)]
+
+# Translation of a row of genotype codes into its low and high bit planes
+LOW_BITS = str.maketrans("0123", "0101")
+HIGH_BITS = str.maketrans("0123", "0011")
+
+def genotype_code(genotype):
+    """
+    Converts a VCF GT field (eg. '0/1', '1|1', '1' for haploids, './.') into a 2-bit genotype code.
+    Calls with two different alternative alleles (eg. '1/2') are heterozygous.
+    """
+    alleles = genotype.replace('|', '/').split('/')
+    if '.' in alleles or '' in alleles:
+        return MISSING
+    if len(set(alleles)) > 1:
+        return HET
+    return HOM_REF if alleles[0] == '0' else HOM_ALT
+
+def called_alleles(genotype, alt):
+    """
+    Returns the alternative alleles carried by a call, so that calls of different alternative alleles are
+    not confused (eg. 'G' for '2/2' with ALT 'A,G', 'A,G' for '1/2'), or '' for reference and missing calls.
+    """
+    alts = alt.split(',')
+    indices = {allele for allele in genotype.replace('|', '/').split('/') if allele.isdigit() and allele != '0'}
+    return ','.join(sorted(alts[int(index) - 1] for index in indices if int(index) <= len(alts)))
+
+class PackedGenotypes:
+    """
+    Genotypes of one sample at a fixed list of sites, packed 4 per byte (2 bits each).
+
+    A new array holds HOM_REF everywhere, as a site absent from a VCF file is a reference call.
+    """
+
+    __slots__ = ('data', 'size')
+
+    def __init__(self, size):
+        self.data = bytearray((size + 3) // 4)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.data[index >> 2] >> ((index & 3) << 1) & 3
+
+    def __setitem__(self, index, code):
+        shift = (index & 3) << 1
+        self.data[index >> 2] = self.data[index >> 2] & ~(3 << shift) | code << shift
+
+    def codes(self, start, stop):
+        """Returns the genotype codes of the sites start to stop - 1 as a string of digits (start is a multiple of 4)."""
+        return "".join(map(BYTE_CODES.__getitem__, self.data[start >> 2:(stop + 3) >> 2]))[:stop - start]
+
+def bit_planes(codes):
+    """
+    Splits a row of genotype codes into two bit planes, so all the samples of a site are classified at once.
+
+    Parameters:
+        codes (str): One genotype code ('0' to '3') per sample.
+
+    Returns:
+        low (int), high (int): Low and high bits of the codes, bit j holding sample j.
+    """
+    return int(codes.translate(LOW_BITS)[::-1] or "0", 2), int(codes.translate(HIGH_BITS)[::-1] or "0", 2)
+
+def classify(low, high, founder1, founder2, n_samples):
+    """
+    Classifies the samples of a site as Ancestry1, Het, Ancestry2 or Unknown with bitwise operations.
+
+    The site is informative when the two founders are opposite homozygotes. Homozygous samples take
+    the ancestry of the founder they match, heterozygous samples are Het and missing calls are Unknown.
+
+    Parameters:
+        low (int), high (int): Bit planes of the genotypes of the samples (see bit_planes).
+        founder1 (int), founder2 (int): Genotype codes of the founders.
+        n_samples (int): Number of samples.
+
+    Returns:
+        tuple: Bit planes of the class codes (indices of CLASS_LABELS), or None if the site is uninformative.
+    """
+    if founder1 == HOM_REF and founder2 == HOM_ALT:
+        return low, high
+    if founder1 == HOM_ALT and founder2 == HOM_REF:
+        # Swap the homozygous codes (0 <-> 2): flip the high bit where the low bit is clear
+        return low, high ^ (~low & ((1 << n_samples) - 1))
+    return None
+
+def class_labels(low, high, n_samples):
+    """Converts the bit planes of class codes into one label per sample."""
+    if not n_samples:
+        return []
+    lows = format(low, f"0{n_samples}b")[::-1]
+    highs = format(high, f"0{n_samples}b")[::-1]
+    return [CLASS_LABELS[(h == "1") << 1 | (l == "1")] for h, l in zip(highs, lows)]
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import csv
+import sys
+import math
+import time
+import argparse
+from collections import defaultdict
+
+from PePa_BC_BGZF import open_table
+from PePa_BC_ClusterClusters import write_output
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Founder bitmask of each label of the comparison table (BOTH only remains if it was not filtered out),
+# and code of the heterozygous SNPs of genotype tables (ComparisonTable -g), after the bitmasks
+LABEL_MASKS = {"Unknown": 0, "Ancestry1": 1, "Ancestry2": 2, "BOTH": 3, "Het": 4}
+HET = 4
+
+# Memory for the work arrays of a block of samples, of shape (n_snps, n_states, samples) with up to 4 bytes
+# per value (the forward pass of posterior decoding): a chromosome of 500k SNPs with 4 states is decoded
+# 64 samples at a time, instead of needing 2 GB for a cohort of 250
+BLOCK_MEMORY = 512 * 2**20
+
+def sample_block(n_snps, n_states):
+    """Number of samples decoded together so that the work arrays fit in BLOCK_MEMORY."""
+    return max(1, BLOCK_MEMORY // (4 * n_states * max(1, n_snps)))
+
+def read_observations(input_file, masks=False):
+    """
+    Reads a comparison table into founder bitmasks, grouped by chromosome and sorted by position.
+
+    Parameters:
+        input_file (str): Path to the comparison table (eg. <basename>_Transformed.csv).
+        masks (bool): Whether the table holds founder bitmasks (ComparisonTable -m) instead of labels.
+
+    Returns:
+        n_samples (int): Number of Individuals.
+        chromosomes (dict): Mapping of chromosome -> (positions, observations), as arrays of shape
+                            (n_snps,) and (n_snps, n_samples).
+        n_founders (int): Number of founders.
+        het (bool): Whether the table holds heterozygous SNPs.
+        observed (set): Codes found in the table (eg. no BOTH when the table was filtered with -b).
+    """
+    rows = defaultdict(list)
+    largest = 0
+
+    with open_table(input_file, 'r') as file:
+        reader = csv.reader(file, delimiter='\t')
+        n_samples = len(next(reader)) - 2
+        for row in reader:
+            if masks:
+                codes = bytes(int(value) for value in row[2:])
+                largest = max(largest, max(codes, default=0))
+            else:
+                codes = bytes(LABEL_MASKS[value] for value in row[2:])
+            rows[row[0]].append((int(row[1]), codes))
+
+    chromosomes = {}
+    for chrom in sorted(rows):
+        snps = sorted(rows[chrom], key=lambda snp: snp[0])
+        positions = np.array([pos for pos, _ in snps], dtype=np.int64)
+        observations = np.frombuffer(b"".join(codes for _, codes in snps), dtype=np.uint8).reshape(len(snps), n_samples)
+        chromosomes[chrom] = (positions, observations)
+
+    n_founders = max(2, largest.bit_length()) if masks else 2
+    observed = set()
+    for _, observations in chromosomes.values():
+        observed.update(np.unique(observations).tolist())
+    het = not masks and HET in observed
+    return n_samples, chromosomes, n_founders, het, observed
+
+def emission_table(n_founders, error, unknown, het=False, observed=None):
+    """
+    Builds the log-probability of each founder bitmask (and of Het SNPs) in each hidden state.
+
+    The states are the founders (Ancestry1, Ancestry2, ...), Het if the table holds heterozygous SNPs,
+    then Unknown. In the state of a founder, a SNP matches this founder (its bit is set) except for
+    genotyping errors and sites matching no founder; in the Het state, SNPs are heterozygous with the
+    same error rates. In the Unknown state, half of the SNPs match no founder and the others are spread
+    over the other codes.
+
+    The mass of each class (match, error, no founder) is divided over the codes of the class that can
+    occur, so every row is a probability distribution over these codes whatever the number of founders.
+    Codes that cannot occur (eg. BOTH in a table filtered with ComparisonTable -b) get no mass, so they
+    do not take probability away from the states they would match.
+
+    Parameters:
+        n_founders (int): Number of founders.
+        error (float): Probability that a SNP matches another founder than its block.
+        unknown (float): Probability that a SNP of a founder block matches no founder.
+        het (bool): Whether the table holds heterozygous SNPs.
+        observed (set): Codes that can occur, or None for all of them. No founder, the code of each
+                        founder alone and Het are always possible.
+
+    Returns:
+        array: Log-probabilities of shape (n_states, 2**n_founders, plus 1 with het).
+    """
+    n_masks = 1 << n_founders
+    n_codes = n_masks + het
+    possible = set(range(n_codes)) if observed is None else set(observed) & set(range(n_codes))
+    possible |= {0} | {1 << founder for founder in range(n_founders)} | ({HET} if het else set())
+
+    table = np.zeros((n_founders + het + 1, n_codes))
+    for state in range(n_founders + het):
+        if state < n_founders:
+            matches = {code for code in possible if code < n_masks and code >> state & 1}
+        else:
+            matches = {HET}
+        errors = possible - matches - {0}
+        for code in matches:
+            table[state, code] = (1 - error - unknown) / len(matches)
+        for code in errors:
+            table[state, code] = error / len(errors)
+        table[state, 0] = unknown
+    table[-1, 0] = 0.5
+    for code in possible - {0}:
+        table[-1, code] = 0.5 / (len(possible) - 1)
+    # Codes that cannot occur have a log-probability of -inf
+    with np.errstate(divide='ignore'):
+        return np.log(table)
+
+def switch_probabilities(positions, rate):
+    """
+    Probability of a recombination between consecutive SNPs from their distance (Haldane map function).
+
+    Parameters:
+        positions (array): Sorted positions of the SNPs.
+        rate (float): Recombination rate in cM/Mb.
+    """
+    morgans = np.diff(positions) * rate * 1e-8
+    return np.clip(0.5 * (1 - np.exp(-2 * morgans)), 1e-12, 0.5)
+
+def viterbi(observations, log_emissions, switch):
+    """
+    Most likely path of hidden states of every sample of a chromosome, decoded at once.
+
+    A state is left towards any of the other states with the same probability, so the best predecessor
+    of a state is either the state itself or the overall best state, and each step costs O(states x samples).
+
+    Parameters:
+        observations (array): Founder bitmasks of shape (n_snps, n_samples).
+        log_emissions (array): Output of emission_table.
+        switch (array): Recombination probability between consecutive SNPs, of shape (n_snps - 1,).
+
+    Returns:
+        array: State indices of shape (n_snps, n_samples).
+    """
+    n_snps, n_samples = observations.shape
+    n_states = log_emissions.shape[0]
+    log_stay = np.log1p(-switch)
+    log_move = np.log(switch / (n_states - 1))
+    states = np.arange(n_states)[:, None]
+    samples = np.arange(n_samples)
+
+    backpointers = np.empty((n_snps, n_states, n_samples), dtype=np.int8)
+    delta = log_emissions[:, observations[0]] - math.log(n_states)
+    for t in range(1, n_snps):
+        best = delta.max(axis=0)
+        best_state = delta.argmax(axis=0)
+        stay = delta + log_stay[t - 1]
+        move = best + log_move[t - 1]
+        backpointers[t] = np.where(stay >= move, states, best_state)
+        delta = np.maximum(stay, move) + log_emissions[:, observations[t]]
+
+    path = np.empty((n_snps, n_samples), dtype=np.int8)
+    path[-1] = delta.argmax(axis=0)
+    for t in range(n_snps - 1, 0, -1):
+        path[t - 1] = backpointers[t, path[t], samples]
+    return path
+
+def posterior(observations, log_emissions, switch, min_posterior=0.0):
+    """
+    Most likely hidden state at each SNP (posterior decoding) for every sample of a chromosome, with
+    the scaled forward-backward algorithm.
+
+    Parameters:
+        observations (array): Founder bitmasks of shape (n_snps, n_samples).
+        log_emissions (array): Output of emission_table.
+        switch (array): Recombination probability between consecutive SNPs, of shape (n_snps - 1,).
+        min_posterior (float): SNPs whose best state has a lower posterior probability are called Unknown.
+
+    Returns:
+        array: State indices of shape (n_snps, n_samples).
+    """
+    n_snps, n_samples = observations.shape
+    n_states = log_emissions.shape[0]
+    emissions = np.exp(log_emissions)
+    move = switch / (n_states - 1)
+    stay = 1 - switch - move  # Staying, beyond the share of the uniform move
+
+    forward = np.empty((n_snps, n_states, n_samples), dtype=np.float32)
+    alpha = emissions[:, observations[0]] / n_states
+    alpha /= alpha.sum(axis=0)
+    forward[0] = alpha
+    for t in range(1, n_snps):
+        alpha = (alpha * stay[t - 1] + move[t - 1]) * emissions[:, observations[t]]
+        alpha /= alpha.sum(axis=0)
+        forward[t] = alpha
+
+    path = np.empty((n_snps, n_samples), dtype=np.int8)
+    beta = np.ones((n_states, n_samples))
+    for t in range(n_snps - 1, -1, -1):
+        probabilities = forward[t] * beta
+        probabilities /= probabilities.sum(axis=0)
+        path[t] = probabilities.argmax(axis=0)
+        if min_posterior > 0:
+            path[t][probabilities.max(axis=0) < min_posterior] = n_states - 1
+        if t > 0:
+            weighted = emissions[:, observations[t]] * beta
+            beta = weighted * stay[t - 1] + move[t - 1] * weighted.sum(axis=0)
+            beta /= beta.sum(axis=0)
+    return path
+
+def path_segments(chrom, positions, path, labels, output_file_base):
+    """
+    Converts the decoded states of a chromosome into segments, from the first to the last SNP of each run
+    of identical states, as the clustering does.
+
+    Returns:
+        list: Segments as dictionaries with the keys of the _Clustered.csv columns.
+    """
+    segments = []
+    for sample in range(path.shape[1]):
+        states = path[:, sample]
+        changes = np.flatnonzero(states[1:] != states[:-1])
+        starts = np.concatenate(([0], changes + 1))
+        ends = np.concatenate((changes, [len(states) - 1]))
+        for start, end in zip(starts, ends):
+            segments.append({
+                'Chromosome': chrom,
+                'Start': int(positions[start]),
+                'End': int(positions[end]),
+                'Ancestry': labels[states[start]],
+                'filename': f"{output_file_base}{sample + 1}",
+            })
+    return segments
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Calls ancestry blocks from a comparison table with a hidden Markov model, as an alternative to\n'
+                    'ClusteringSNPs and ClusterClusters. The hidden states are the founders (plus Het for genotype tables,\n'
+                    'see ComparisonTable -g) and Unknown, and the probability of switching between SNPs grows with their\n'
+                    'distance. All the Individuals of a chromosome are decoded at once with NumPy. The output has the\n'
+                    'columns of <basename>_Clustered.csv.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('input_file', help='Path to the comparison table (eg. <basename>_Transformed.csv)')
+    parser.add_argument('output_file_base', help='Base name of the Individuals (named <base>1, <base>2, ...)')
+    parser.add_argument('-O', '--output', required=True, help='Path to the output file (eg. <basename>_Clustered.csv)')
+    parser.add_argument('-RATE', type=float, default=1.0, help='Recombination rate in cM/Mb (default: 1)')
+    parser.add_argument('-ERROR', type=float, default=0.01, help='Probability that a SNP matches another founder than its block (default: 0.01)')
+    parser.add_argument('-UNKNOWN', type=float, default=0.01, help='Probability that a SNP of a founder block matches no founder (default: 0.01)')
+    parser.add_argument('-DECODE', choices=['viterbi', 'posterior'], default='viterbi',
+                        help='viterbi: most likely sequence of blocks (default)\nposterior: most likely ancestry at each SNP')
+    parser.add_argument('-MINPOST', type=float, default=0.0, help='With posterior decoding, call Unknown the SNPs with a lower posterior probability (eg. 0.9)')
+    parser.add_argument('-MASK', action='store_true', help='Input holds founder bitmasks (ComparisonTable -m) instead of labels')
+    args = parser.parse_args()
+
+    if np is None:
+        print("Error: The HMM caller requires NumPy, install it with 'pip install numpy'.")
+        sys.exit(1)
+    if not (args.RATE > 0 and 0 < args.ERROR and 0 < args.UNKNOWN and args.ERROR + args.UNKNOWN < 1):
+        parser.error("the rate must be positive, and the error and unknown probabilities positive with a sum below 1")
+
+    n_samples, chromosomes, n_founders, het, observed = read_observations(args.input_file, args.MASK)
+    if n_founders > 8:
+        parser.error("the HMM caller supports up to 8 founders")
+    labels = [f"Ancestry{founder + 1}" for founder in range(n_founders)] + (["Het"] if het else []) + ["Unknown"]
+    log_emissions = emission_table(n_founders, args.ERROR, args.UNKNOWN, het, observed)
+    print(f"Decoding {n_samples} Individuals on {len(chromosomes)} chromosomes with {len(labels)} states ({args.DECODE})")
+
+    segments = []
+    for chrom, (positions, observations) in chromosomes.items():
+        switch = switch_probabilities(positions, args.RATE)
+        # Samples are independent, so they are decoded in blocks to bound the memory of the work arrays
+        path = np.empty(observations.shape, dtype=np.int8)
+        size = sample_block(len(positions), len(labels))
+        for start in range(0, n_samples, size):
+            block = np.ascontiguousarray(observations[:, start:start + size])
+            if args.DECODE == 'viterbi':
+                path[:, start:start + size] = viterbi(block, log_emissions, switch)
+            else:
+                path[:, start:start + size] = posterior(block, log_emissions, switch, args.MINPOST)
+        segments.extend(path_segments(chrom, positions, path, labels, args.output_file_base))
+
+    # Same order as ClusterClusters: by Individual, chromosome and start
+    segments.sort(key=lambda x: (x['filename'], x['Chromosome'], x['Start']))
+    write_output(segments, args.output)
+
+if __name__ == "__main__":
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
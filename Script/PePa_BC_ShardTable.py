@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import sys
+import json
+import time
+import heapq
+import hashlib
+import socket
+import argparse
+import threading
+import multiprocessing as mp
+
+from PePa_BC_BGZF import open_table
+from PePa_BC_VCFtoTable import tabulate_vcfs, parse_regions, normalise_name
+
+QUEUE_FILE = "queue.json"
+
+def shard_name(queue, index):
+    return f"shard_{queue['version']}_{index:04d}"
+
+def input_fingerprint(paths):
+    """
+    Records the size and modification time of each input file, so a queue is only reused on unchanged inputs.
+
+    Returns:
+        dict: Mapping of path -> [size, modification time in ns].
+    """
+    fingerprint = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            print(f"Error: The file '{path}' does not exist.")
+            sys.exit(1)
+        fingerprint[path] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+def create_queue(queue_dir, vcf_files, target1, target2, founders, apply_filter, n_shards, regions=None, min_snps=0,
+                 genotypes=False):
+    """
+    Creates the work queue on a shared filesystem, splitting the VCF files into contiguous sample shards.
+
+    If the queue already exists with the same content (including the size and modification time of every
+    input file) it is reused, so shards completed by a previous (interrupted) run are not processed again.
+    Otherwise a new queue replaces it. The shards are named after a version, the hash of the queue content,
+    so shards of an older queue, even published late by one of its workers, are never merged.
+
+    Parameters:
+        queue_dir (str): Folder holding the queue, visible from every worker.
+        vcf_files (list): List of the VCF files of the individuals.
+        target1 (str): Path to the first target VCF file (P1).
+        target2 (str): Path to the second target VCF file (P2).
+        founders (list): Paths to additional founder VCF files.
+        apply_filter (bool): Whether to filter out variants that did not pass the filter.
+        n_shards (int): Number of sample shards.
+        regions (str): Comma-separated regions to tabulate (see parse_regions), or None for all variants.
+        min_snps (int): Skip the chromosomes with less than this number of variant sites in the founders.
+        genotypes (bool): Tabulate genotype codes, keeping heterozygous and missing calls (VCFtoTable -GENOTYPES).
+
+    Returns:
+        dict: The queue description.
+    """
+    n_shards = max(1, min(n_shards, len(vcf_files)))
+    size, extra = divmod(len(vcf_files), n_shards)
+    shards = []
+    start = 0
+    for index in range(n_shards):
+        end = start + size + (1 if index < extra else 0)
+        shards.append(vcf_files[start:end])
+        start = end
+
+    # VCF paths stay as given, so the header matches a single run; workers move to the same folder instead
+    queue = {
+        "directory": os.getcwd(),
+        "target1": target1,
+        "target2": target2,
+        "founders": founders,
+        "filter": apply_filter,
+        "regions": regions,
+        "min_snps": min_snps,
+        "genotypes": genotypes,
+        "shards": shards,
+        "inputs": input_fingerprint([target1, target2] + founders + vcf_files),
+    }
+    queue["version"] = hashlib.sha1(json.dumps(queue, sort_keys=True).encode()).hexdigest()[:12]
+
+    os.makedirs(queue_dir, exist_ok=True)
+    queue_path = os.path.join(queue_dir, QUEUE_FILE)
+    if os.path.exists(queue_path):
+        with open(queue_path, 'r') as file:
+            if json.load(file) == queue:
+                print(f"Reusing the queue in '{queue_dir}'")
+                return queue
+        print(f"The inputs changed since the queue in '{queue_dir}' was created, starting a new queue")
+
+    temp_path = f"{queue_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(queue, file, indent=1)
+    os.replace(temp_path, queue_path)
+
+    # Published shards and locks of older queues are of no use anymore (temporary files may still be written)
+    prefix = f"shard_{queue['version']}_"
+    for name in os.listdir(queue_dir):
+        if name.startswith("shard_") and not name.startswith(prefix) and name.endswith((".csv", ".lock")):
+            os.remove(os.path.join(queue_dir, name))
+    print(f"Queue of {n_shards} shards created in '{queue_dir}'")
+
+    return queue
+
+def read_queue(queue_dir):
+    with open(os.path.join(queue_dir, QUEUE_FILE), 'r') as file:
+        return json.load(file)
+
+def lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}\n"
+
+def lease_holder(lock_path):
+    """Returns the worker named in a lock file, or None if there is no lock."""
+    try:
+        with open(lock_path, 'r') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+def try_lease(lock_path, lease):
+    """
+    Tries to take the lease of a shard by creating its lock file atomically.
+
+    A lock that was not refreshed for more than `lease` seconds belongs to a dead worker: it is
+    renamed away (only one worker can win the rename) and the lease is taken again. Checking the
+    age and renaming are two steps, so another worker may have taken the lease over in between:
+    the renamed lock must still be the expired one, and the new lock must name this worker.
+
+    Returns:
+        bool: True if the lease was taken.
+    """
+    owner = lease_owner()
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, owner.encode())
+            os.close(fd)
+        except FileExistsError:
+            try:
+                expired = os.stat(lock_path)
+                if time.time() - expired.st_mtime <= lease:
+                    return False
+                expired_path = f"{lock_path}.{socket.gethostname()}.{os.getpid()}.expired"
+                os.rename(lock_path, expired_path)
+                renamed = os.stat(expired_path)
+                if (renamed.st_ino, renamed.st_mtime_ns) != (expired.st_ino, expired.st_mtime_ns):
+                    # The live lock of a worker that took over first was renamed: put it back
+                    try:
+                        os.link(expired_path, lock_path)
+                    except FileExistsError:
+                        pass
+                    os.remove(expired_path)
+                    return False
+                os.remove(expired_path)
+            except FileNotFoundError:
+                pass  # Another worker released or took over the lock in the meantime
+            continue
+
+        # The new lock may have been renamed away by a worker that found the old one expired
+        return lease_holder(lock_path) == owner
+    return False
+
+def release_lease(lock_path):
+    """Removes the lock file, unless the lease expired and was taken over by another worker."""
+    if lease_holder(lock_path) != lease_owner():
+        return
+    try:
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+def heartbeat(lock_path, lease, stop):
+    """Refreshes the lock file while the shard is processed, so the lease does not expire."""
+    owner = lease_owner()
+    while not stop.wait(lease / 4):
+        # A lock taken over by another worker is not refreshed
+        if lease_holder(lock_path) != owner:
+            return
+        try:
+            os.utime(lock_path)
+        except FileNotFoundError:
+            return
+
+def run_worker(queue_dir, lease):
+    """
+    Processes shards of the queue until none is left to lease.
+
+    Parameters:
+        queue_dir (str): Folder holding the queue.
+        lease (int): Seconds after which the lock of a silent worker expires.
+    """
+    queue_dir = os.path.abspath(queue_dir)
+    queue = read_queue(queue_dir)
+    os.chdir(queue["directory"])
+    regions = parse_regions(queue["regions"]) if queue["regions"] else None
+
+    for index, shard in enumerate(queue["shards"]):
+        name = shard_name(queue, index)
+        output_path = os.path.join(queue_dir, f"{name}.csv")
+        lock_path = os.path.join(queue_dir, f"{name}.lock")
+
+        if os.path.exists(output_path) or not try_lease(lock_path, lease):
+            continue
+
+        print(f"{socket.gethostname()}:{os.getpid()} processing {name} ({len(shard)} samples)")
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(lock_path, lease, stop), daemon=True)
+        beat.start()
+        try:
+            # Write the shard aside and publish it atomically, so a partial shard is never merged
+            temp_path = f"{output_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+            tabulate_vcfs(shard, queue["target1"], queue["target2"], queue["founders"], temp_path, queue["filter"],
+                          regions, queue["min_snps"], genotypes=queue.get("genotypes", False))
+            os.replace(temp_path, output_path)
+        finally:
+            stop.set()
+            beat.join()
+            release_lease(lock_path)
+
+def wait_for_shards(queue_dir, lease, poll=10):
+    """
+    Waits until every shard of the queue has been published, including those leased by other nodes.
+
+    The shards left by a worker that died are only leased again once their lock expires, so the queue
+    is worked through again at each poll, taking over the expired leases.
+
+    Parameters:
+        queue_dir (str): Folder holding the queue.
+        lease (int): Seconds after which the lock of a silent worker expires.
+        poll (int): Seconds between two checks of the shards.
+    """
+    queue_dir = os.path.abspath(queue_dir)
+    queue = read_queue(queue_dir)
+    while True:
+        run_worker(queue_dir, lease)
+        missing = [shard_name(queue, index) for index in range(len(queue["shards"]))
+                   if not os.path.exists(os.path.join(queue_dir, f"{shard_name(queue, index)}.csv"))]
+        if not missing:
+            return
+        print(f"Waiting for {len(missing)} shards: {' '.join(missing[:5])}{' ...' if len(missing) > 5 else ''}")
+        time.sleep(poll)
+
+def read_shard(index, path):
+    """Yields ((chromosome, position, ref), shard index, row) for each row of a shard table."""
+    with open(path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header
+        for row in reader:
+            yield (row[0], int(row[1]), row[2]), index, row
+
+def merge_shards(queue_dir, output_file, normalise=False):
+    """
+    Merges the shard tables into the table a single run over all samples would produce.
+
+    Shard tables are sorted by chromosome, position and reference, so they are merged in one
+    streaming pass. A site missing from a shard means none of its samples carries the variant
+    (homozygous for the reference allele in a genotype table).
+
+    Parameters:
+        queue_dir (str): Folder holding the queue and the shard tables.
+        output_file (str): Path to the merged output file (bgzip-compressed if named *.gz).
+        normalise (bool): Write the table used by the pipeline, as tabulate_vcfs does.
+    """
+    queue = read_queue(queue_dir)
+    shards = queue["shards"]
+    n_founders = 2 + len(queue["founders"])
+    header = [queue["target1"], queue["target2"]] + queue["founders"] + [vcf for shard in shards for vcf in shard]
+    if normalise:
+        header = [normalise_name(name) for name in header]
+    paths = [os.path.join(queue_dir, f"{shard_name(queue, index)}.csv") for index in range(len(shards))]
+
+    with open_table(output_file, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t' if normalise else ',')
+        writer.writerow(["Chromosome", "Position", "Ref"] + header)
+
+        absent = '0' if queue.get("genotypes") else '-'
+        current_key = None
+        current_rows = {}
+
+        def write_site():
+            first = next(iter(current_rows.values()))
+            row = first[:3 + n_founders]
+            for index, shard in enumerate(shards):
+                shard_row = current_rows.get(index)
+                row += shard_row[3 + n_founders:] if shard_row else [absent] * len(shard)
+            if normalise:
+                row[3:] = ['0' if value == '-' else value for value in row[3:]]
+            writer.writerow(row)
+
+        for key, index, row in heapq.merge(*(read_shard(index, path) for index, path in enumerate(paths))):
+            if key != current_key:
+                if current_rows:
+                    write_site()
+                current_key = key
+                current_rows = {}
+            current_rows[index] = row
+        if current_rows:
+            write_site()
+
+    print(f"Merged {len(shards)} shards into: '{output_file}'")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tabulates a list of VCF files in sample shards processed by independent workers, and merges them.\n"
+                    "The coordinator creates the queue, starts local workers, waits for all shards and merges them.\n"
+                    "Workers on other nodes join the same run with: -WORKER -Q <queue folder on the shared filesystem>",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-L', '--list', help="Path to a file containing a list of VCF files to compare.")
+    parser.add_argument('-P1', '--target1', help="Path to the first target VCF file (P1) to compare against.")
+    parser.add_argument('-P2', '--target2', help="Path to the second target VCF file (P2) to compare against.")
+    parser.add_argument('-PX', '--founders', nargs='+', default=[], help="Paths to additional founder VCF files (P3, P4, ...) for multi-parent crosses.")
+    parser.add_argument('-O', '--output', help="Path to the merged output file.")
+    parser.add_argument('-FILTER', action='store_true', help="Only include variants that passed the filter (PASS).")
+    parser.add_argument('-R', '--regions', help="Only include variants of these comma-separated regions (eg. Chr1:1000000-2000000,Chr2).")
+    parser.add_argument('-M', '--min-snps-per-chrom', type=int, default=0, help="Skip chromosomes with less than this number of SNPs in the founders (eg. 200).")
+    parser.add_argument('-NORMALISE', action='store_true', help="Write the table used by the pipeline: tab-separated, '.vcf.gz' removed from the names\n"
+                                                              "and variants absent from a file written as 0 (output compressed if named *.gz).")
+    parser.add_argument('-GENOTYPES', action='store_true', help="Write genotype codes, keeping heterozygous and missing calls (see VCFtoTable -GENOTYPES).")
+    parser.add_argument('-N', '--shards', type=int, default=4, help="Number of sample shards (default: 4).")
+    parser.add_argument('-Q', '--queue', required=True, help="Queue folder, on a filesystem shared by all workers.")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of local worker processes (default: number of shards, up to half the CPUs).")
+    parser.add_argument('--lease', type=int, default=600, help="Seconds after which the lock of a silent worker expires (default: 600).")
+    parser.add_argument('-WORKER', action='store_true', help="Only process shards of an existing queue.")
+    parser.add_argument('-MERGE', action='store_true', help="Only wait for the shards of an existing queue (taking over expired leases) and merge them.")
+    args = parser.parse_args()
+
+    # Workers move to the folder of the VCF files, so the paths of the queue and of the output must not depend on it
+    args.queue = os.path.abspath(args.queue)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    if args.WORKER:
+        run_worker(args.queue, args.lease)
+        return
+
+    if not args.output:
+        parser.error("the -O/--output flag is required to merge the shards")
+
+    if not args.MERGE:
+        if not (args.list and args.target1 and args.target2):
+            parser.error("the -L, -P1 and -P2 flags are required to create the queue")
+
+        # Check the regions before any worker starts
+        if args.regions:
+            try:
+                parse_regions(args.regions)
+            except ValueError as error:
+                parser.error(str(error))
+
+        with open(args.list, 'r') as file_list:
+            vcf_files = [line.strip() for line in file_list if line.strip()]
+
+        queue = create_queue(args.queue, vcf_files, args.target1, args.target2, args.founders, args.FILTER, args.shards,
+                             args.regions, args.min_snps_per_chrom, args.GENOTYPES)
+
+        # Each local worker stands in for a node: it leases shards from the queue until none is left
+        n_workers = args.workers or min(len(queue["shards"]), max(1, os.cpu_count()//2))
+        workers = [mp.Process(target=run_worker, args=(args.queue, args.lease)) for _ in range(n_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if any(worker.exitcode != 0 for worker in workers):
+            print("Error: A local worker failed, its shard can be processed again by re-running the same command.")
+            sys.exit(1)
+
+    wait_for_shards(args.queue, args.lease)
+    merge_shards(args.queue, args.output, args.NORMALISE)
+
+if __name__ == "__main__":
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
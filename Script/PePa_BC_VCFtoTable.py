@@ -4,6 +4,7 @@ import gzip
 import sys
 import time
 import argparse
+from array import array
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 import os
@@ -11,7 +12,131 @@ import tempfile
 import csv
 import glob
 
-def extract_variants(vcf_file, apply_filter):
+from PePa_BC_BGZF import find_index, read_tabix_index, region_offset, bgzf_lines, open_table
+from PePa_BC_Genotypes import genotype_code, called_alleles, PackedGenotypes, HET, HOM_ALT, MISSING
+
+def normalise_name(vcf_file):
+    """Turns a VCF file name into the column name used by the pipeline (no '.vcf.gz', '-' replaced by '0')."""
+    return vcf_file.replace('.vcf.gz', '').replace('-', '0')
+
+def parse_regions(text):
+    """
+    Parses a comma-separated list of regions (eg. 'Chr1:1000000-2000000,Chr2,Chr3:500000-').
+
+    A chromosome alone stands for the whole chromosome, and a missing end for the end of the chromosome.
+    Overlapping regions of a chromosome are merged, so no variant is extracted twice.
+
+    Args:
+        text (str): The list of regions.
+
+    Returns:
+        dict: Mapping of chromosome -> sorted list of (start, end) tuples, 1-based and inclusive (end is None for the end of the chromosome).
+    """
+    regions = defaultdict(list)
+    for region in text.split(','):
+        region = region.strip()
+        if not region:
+            continue
+        chrom, _, interval = region.partition(':')
+        start, _, end = interval.partition('-')
+        try:
+            start = int(start) if start else 1
+            end = int(end) if end else None
+        except ValueError:
+            raise ValueError(f"Cannot parse the region '{region}' (expected Chr, Chr:Start-End or Chr:Start-).")
+        if end is not None and end < start:
+            raise ValueError(f"The region '{region}' ends before its start.")
+        regions[chrom].append((start, end))
+
+    merged = {}
+    for chrom, intervals in regions.items():
+        intervals.sort(key=lambda x: x[0])
+        merged[chrom] = [intervals[0]]
+        for start, end in intervals[1:]:
+            last_start, last_end = merged[chrom][-1]
+            if last_end is None or start <= last_end + 1:
+                merged[chrom][-1] = (last_start, None if end is None or last_end is None else max(end, last_end))
+            else:
+                merged[chrom].append((start, end))
+    return merged
+
+def in_regions(regions, chrom, pos):
+    """Checks whether a position falls within the regions of its chromosome."""
+    return any(start <= pos and (end is None or pos <= end) for start, end in regions.get(chrom, ()))
+
+def read_vcf_lines(vcf_file, regions=None):
+    """
+    Yields the lines of a VCF file, only reading the requested regions when the file is indexed.
+
+    For a bgzipped file with a tabix index (<file>.tbi), the reader seeks to the first block that can
+    hold each region and stops at the end of the region, so the rest of the file is never decompressed.
+    Otherwise the whole file is read; lines outside the regions are then left to the caller to skip.
+
+    Args:
+        vcf_file (str): Path to the VCF file (either compressed or uncompressed).
+        regions (dict): Regions to read, as returned by parse_regions, or None for the whole file.
+    """
+    index_file = find_index(vcf_file) if regions is not None else None
+    if index_file is None:
+        # Determine whether the file is gzipped based on the file extension and open accordingly
+        open_func = gzip.open if vcf_file.endswith('.gz') else open
+        with open_func(vcf_file, 'rt') as file:
+            yield from file
+        return
+
+    index = read_tabix_index(index_file)
+    for chrom, intervals in regions.items():
+        for start, end in intervals:
+            offset = region_offset(index, chrom, start, end)
+            if offset is None:
+                continue  # No variant of the file in this region
+            for line in bgzf_lines(vcf_file, offset):
+                if line.startswith("#"):
+                    continue
+                parts = line.split('\t', 2)
+                if parts[0] != chrom or (end is not None and int(parts[1]) > end):
+                    break  # Past the end of the region
+                yield line
+
+def restrict_regions(regions, chromosomes):
+    """Restricts the regions to a set of chromosomes (the whole chromosomes if no regions were requested)."""
+    if regions is None:
+        return {chrom: [(1, None)] for chrom in sorted(chromosomes)}
+    return {chrom: intervals for chrom, intervals in regions.items() if chrom in chromosomes}
+
+def select_chromosomes(temp_files, min_snps):
+    """
+    Selects the chromosomes holding at least min_snps variant sites in the founders.
+
+    Chromosomes are selected from the founders only, so every individual is read on the same
+    chromosomes and small scaffolds (or the mitochondria) can be skipped in all of them.
+    In genotype temporary files, only the variant calls (heterozygous or homozygous alternative) count.
+
+    Args:
+        temp_files (list): Paths to the temporary files of the founders, as written by extract_variants.
+        min_snps (int): Minimum number of variant sites of a chromosome.
+
+    Returns:
+        set: Names of the selected chromosomes.
+    """
+    sites = defaultdict(set)
+    for temp_file in temp_files:
+        with open(temp_file, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)  # Skip header
+            for row in reader:
+                if len(row) > 5 and int(row[5]) not in (HET, HOM_ALT):
+                    continue  # Reference or missing call of a genotype file
+                chrom, pos, ref = row[:3]
+                sites[chrom].add((pos, ref))
+
+    chromosomes = {chrom for chrom, positions in sites.items() if len(positions) >= min_snps}
+    skipped = sorted(set(sites) - chromosomes)
+    if skipped:
+        print(f"Chromosomes with less than {min_snps} SNPs skipped: {' '.join(skipped)}")
+    return chromosomes
+
+def extract_variants(vcf_file, apply_filter, regions=None, genotypes=False):
     """
     Extracts variants from a VCF file and writes them to a temporary CSV file.
 
@@ -21,13 +146,13 @@ def extract_variants(vcf_file, apply_filter):
     Args:
         vcf_file (str): Path to the VCF file (either compressed or uncompressed).
         apply_filter (bool): Whether to filter out variants that did not pass the filter.
+        regions (dict): Only extract the variants of these regions (see parse_regions), or None for all variants.
+        genotypes (bool): Keep heterozygous and missing calls, writing the alternative alleles carried by the call
+                          instead of the Alt field and adding the genotype code (see PePa_BC_Genotypes) as a sixth column.
 
     Returns:
         str: Path to the temporary file containing the extracted variants.
     """
-    # Determine whether the file is gzipped based on the file extension and open accordingly
-    open_func = gzip.open if vcf_file.endswith('.gz') else open
-
     # Create a temporary file to store the variants
     temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', newline='', suffix=".tmp")
     temp_writer = csv.writer(temp_file)
@@ -35,41 +160,134 @@ def extract_variants(vcf_file, apply_filter):
     # Write a header row
     temp_writer.writerow(["Chromosome", "Position", "Ref", "Alt", "File"])
 
-    # Open the VCF file and read line by line
-    with open_func(vcf_file, 'rt') as file:
-        for line in file:
-            if line.startswith("#"):
-                continue  # Skip header lines
-
-            # Split the line into fields based on tab ('\t') separation
-            parts = line.strip().split('\t')
-            # Ensure that there are enough fields to avoid IndexError
-            if len(parts) < 10:
-                continue  # Skip malformed lines
-
-            chrom, pos, ref, alt, filter_info, genotype_info = (
-                parts[0], parts[1], parts[3], parts[4], parts[6], parts[9]
-            )
-
-            # Extract the genotype field from the genotype_info
-            genotype = genotype_info.split(':')[0]
-
-            # Skip heterozygous SNPs (e.g., '0/1', '1/0')
-            if genotype in ['0/1', '1/0']:
-                continue
-
-            # Only include variants based on the filter flag
-            if apply_filter:
-                if filter_info == "PASS" and './.' not in genotype_info and ref != alt:
-                    temp_writer.writerow([chrom, pos, ref, alt, vcf_file])
-            else:
-                if './.' not in genotype_info and ref != alt:
-                    temp_writer.writerow([chrom, pos, ref, alt, vcf_file])
+    # Read the VCF file line by line (only the requested regions if it is indexed)
+    for line in read_vcf_lines(vcf_file, regions):
+        if line.startswith("#"):
+            continue  # Skip header lines
+
+        # Split the line into fields based on tab ('\t') separation
+        parts = line.strip().split('\t')
+        # Ensure that there are enough fields to avoid IndexError
+        if len(parts) < 10:
+            continue  # Skip malformed lines
+
+        chrom, pos, ref, alt, filter_info, genotype_info = (
+            parts[0], parts[1], parts[3], parts[4], parts[6], parts[9]
+        )
+
+        # Skip variants outside the requested regions
+        if regions is not None and not in_regions(regions, chrom, int(pos)):
+            continue
+
+        # Extract the genotype field from the genotype_info
+        genotype = genotype_info.split(':')[0]
+
+        if genotypes:
+            # Heterozygous and missing calls are kept as genotype codes
+            if (not apply_filter or filter_info == "PASS") and ref != alt:
+                temp_writer.writerow([chrom, pos, ref, called_alleles(genotype, alt), vcf_file, genotype_code(genotype)])
+            continue
+
+        # Skip heterozygous SNPs (e.g., '0/1', '1/0')
+        if genotype in ['0/1', '1/0']:
+            continue
+
+        # Only include variants based on the filter flag
+        if apply_filter:
+            if filter_info == "PASS" and './.' not in genotype_info and ref != alt:
+                temp_writer.writerow([chrom, pos, ref, alt, vcf_file])
+        else:
+            if './.' not in genotype_info and ref != alt:
+                temp_writer.writerow([chrom, pos, ref, alt, vcf_file])
 
     temp_file.close()  # Close the temporary file
     return temp_file.name  # Return the path to the temporary file
 
-def write_organized_output(temp_files, output_file, all_files):
+def write_genotype_output(temp_files, output_file, all_files, n_founders, chromosomes=None, normalise=False):
+    """
+    Aggregates the genotype codes of the temporary files into a genotype table.
+
+    Each call is read once and stored as a site number and a code, then the genotypes of each file
+    are moved to a 2-bit packed array over the sorted sites (a quarter of a byte per sample and site),
+    in which sites absent from a file stay homozygous for the reference allele.
+
+    The codes only tell reference from alternative, so the alternative alleles are checked against the
+    founders: sites where the founders carry different alternative alleles are dropped, and calls of an
+    individual carrying another alternative allele than the founders are written as missing. Both only
+    depend on the founders, so tables built separately from sample shards agree.
+
+    Args:
+        temp_files (list): Paths to the temporary files, as written by extract_variants with genotypes, in the order of all_files.
+        output_file (str): Path to the output file.
+        all_files (list): List of all VCF files for the header.
+        n_founders (int): Number of founders, the first files of all_files.
+        chromosomes (set): Only write the variants of these chromosomes, or None for all chromosomes.
+        normalise (bool): Write the table used by the pipeline: tab-separated, with normalised column names.
+    """
+    site_numbers = {}
+    founder_alleles = []  # Alternative allele of the founders at each site, '' if none, None if they disagree
+    file_calls = []
+    for index, temp_file in enumerate(temp_files):
+        numbers = array('I')
+        codes = bytearray()
+        with open(temp_file, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)  # Skip header
+            for chrom, pos, ref, alleles, _, code in reader:
+                if chromosomes is not None and chrom not in chromosomes:
+                    continue
+                number = site_numbers.setdefault((chrom, pos, ref), len(site_numbers))
+                if number == len(founder_alleles):
+                    founder_alleles.append('')
+                code = int(code)
+                if alleles:
+                    if index < n_founders:
+                        if founder_alleles[number] == '':
+                            founder_alleles[number] = alleles
+                        elif founder_alleles[number] != alleles:
+                            founder_alleles[number] = None
+                    elif founder_alleles[number] and alleles != founder_alleles[number]:
+                        code = MISSING
+                numbers.append(number)
+                codes.append(code)
+        file_calls.append((numbers, codes))
+        os.remove(temp_file)
+
+    conflicts = [site for site, number in site_numbers.items() if founder_alleles[number] is None]
+    for site in conflicts:
+        del site_numbers[site]
+    if conflicts:
+        print(f"Sites where the founders carry different alternative alleles skipped: {len(conflicts)}")
+
+    # Sort the sites for consistent output (the Ref breaks ties, so separately built tables can be merged)
+    sites = sorted(site_numbers, key=lambda x: (x[0], int(x[1]), x[2]))
+    # Dropped sites keep the rank of the first site, and their calls are overwritten by it below
+    rank = array('I', bytes(4 * len(founder_alleles)))
+    for i, site in enumerate(sites):
+        rank[site_numbers[site]] = i
+    del site_numbers
+
+    packed = []
+    while file_calls:
+        numbers, codes = file_calls.pop(0)
+        calls = PackedGenotypes(len(sites))
+        for number, code in zip(numbers, codes):
+            if founder_alleles[number] is not None:
+                calls[rank[number]] = code
+        packed.append(calls)
+
+    with open_table(output_file, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t' if normalise else ',')
+        names = [normalise_name(vcf_file) for vcf_file in all_files] if normalise else all_files
+        writer.writerow(["Chromosome", "Position", "Ref"] + names)
+        # Sites are decoded in chunks, so only a few thousand rows are ever held as text
+        for start in range(0, len(sites), 4096):
+            stop = min(start + 4096, len(sites))
+            columns = [calls.codes(start, stop) for calls in packed]
+            for (chrom, pos, ref), codes in zip(sites[start:stop], zip(*columns)):
+                writer.writerow((chrom, pos, ref) + codes)
+
+def write_organized_output(temp_files, output_file, all_files, chromosomes=None, normalise=False):
     """
     Aggregates all partial results from temporary files into a single output file.
 
@@ -77,6 +295,9 @@ def write_organized_output(temp_files, output_file, all_files):
         temp_files (list): List of paths to temporary files containing partial results.
         output_file (str): Path to the output file where differences will be written.
         all_files (list): List of all VCF files for the header.
+        chromosomes (set): Only write the variants of these chromosomes, or None for all chromosomes.
+        normalise (bool): Write the table used by the pipeline: tab-separated, with normalised column names
+                          and variants absent from a file written as 0 instead of '-'.
     """
     # Create a dictionary to hold the combined variant data
     variant_data = defaultdict(dict)
@@ -105,24 +326,88 @@ def write_organized_output(temp_files, output_file, all_files):
             reader = csv.reader(f)
             next(reader)  # Skip header
             for row in reader:
-                chrom, pos, ref, alt, _ = row
+                chrom, pos, ref, alt = row[:4]
+                if chromosomes is not None and chrom not in chromosomes:
+                    continue
                 key = (chrom, pos, ref)
                 variant_data[key][vcf_file] = alt
         # Remove the temp file
         os.remove(temp_file)
 
     # Write the organized output
-    with open(output_file, 'w', newline='') as out:
-        writer = csv.writer(out)
+    # The output is bgzip-compressed if its name ends in .gz
+    with open_table(output_file, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t' if normalise else ',')
         # Write the header
-        writer.writerow(["Chromosome", "Position", "Ref"] + all_files)
-        # Sort the keys for consistent output
-        for key in sorted(variant_data.keys(), key=lambda x: (x[0], int(x[1]))):
+        names = [normalise_name(vcf_file) for vcf_file in all_files] if normalise else all_files
+        writer.writerow(["Chromosome", "Position", "Ref"] + names)
+        absent = '0' if normalise else '-'
+        # Sort the keys for consistent output (the Ref breaks ties, so separately built tables can be merged)
+        for key in sorted(variant_data.keys(), key=lambda x: (x[0], int(x[1]), x[2])):
             chrom, pos, ref = key
             # Get the alt values for each file, or '-' if the file doesn't have this variant
-            alt_values = [variant_data[key].get(vcf_file, '-') for vcf_file in all_files]
+            alt_values = [variant_data[key].get(vcf_file, absent) for vcf_file in all_files]
             writer.writerow([chrom, pos, ref] + alt_values)
 
+def tabulate_vcfs(vcf_files, target1, target2, founders, output_file, apply_filter, regions=None, min_snps=0, normalise=False,
+                  genotypes=False):
+    """
+    Extracts the variants of the founders and of every VCF file in parallel and writes the organized table.
+
+    Args:
+        vcf_files (list): List of the VCF files of the individuals.
+        target1 (str): Path to the first target VCF file (P1).
+        target2 (str): Path to the second target VCF file (P2).
+        founders (list): Paths to additional founder VCF files (P3, P4, ...).
+        output_file (str): Path to the output file where differences will be written.
+        apply_filter (bool): Whether to filter out variants that did not pass the filter.
+        regions (dict): Only tabulate the variants of these regions (see parse_regions), or None for all variants.
+        min_snps (int): Skip the chromosomes with less than this number of variant sites in the founders.
+        normalise (bool): Write the table used by the pipeline (see write_organized_output).
+        genotypes (bool): Write a genotype table keeping heterozygous and missing calls (see write_genotype_output).
+    """
+    # List to store paths of temporary files
+    temp_files = []
+
+    # Collect all file names for the header (founders first, then the individuals)
+    all_files = [target1, target2] + founders + vcf_files
+
+    # Determine the optimal number of workers, using half of available CPUs for safety
+    max_workers = min(len(vcf_files), max(1, os.cpu_count()//2))
+
+    # Use ThreadPoolExecutor to process the VCF files in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Submit the target VCF files for processing
+        future_p1 = executor.submit(extract_variants, target1, apply_filter, regions, genotypes)
+        future_p2 = executor.submit(extract_variants, target2, apply_filter, regions, genotypes)
+        future_px = [executor.submit(extract_variants, founder, apply_filter, regions, genotypes) for founder in founders]
+
+        # The chromosomes are selected from the founders, so the individuals are only read on the selected chromosomes
+        chromosomes = None
+        if min_snps > 0:
+            chromosomes = select_chromosomes([future.result() for future in [future_p1, future_p2] + future_px], min_snps)
+            regions = restrict_regions(regions, chromosomes)
+
+        # Submit each file in the list for processing in parallel
+        future_vcfs = {executor.submit(extract_variants, vcf_file, apply_filter, regions, genotypes): vcf_file for vcf_file in vcf_files}
+
+        # Collect the temporary file paths
+        temp_files.append(future_p1.result())
+        temp_files.append(future_p2.result())
+
+        for future in future_px:
+            temp_files.append(future.result())
+
+        for future in future_vcfs:
+            temp_file = future.result()
+            temp_files.append(temp_file)
+
+    # Now, aggregate the temporary files
+    if genotypes:
+        write_genotype_output(temp_files, output_file, all_files, 2 + len(founders), chromosomes, normalise)
+    else:
+        write_organized_output(temp_files, output_file, all_files, chromosomes, normalise)
+
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(
@@ -134,12 +419,25 @@ if __name__ == "__main__":
     parser.add_argument('-L', '--list', required=True, help="Path to a file containing a list of VCF files to compare.")
     parser.add_argument('-P1', '--target1', required=True, help="Path to the first target VCF file (P1) to compare against.")
     parser.add_argument('-P2', '--target2', required=True, help="Path to the second target VCF file (P2) to compare against.")
+    parser.add_argument('-PX', '--founders', nargs='+', default=[], help="Paths to additional founder VCF files (P3, P4, ...) for multi-parent crosses.")
     parser.add_argument('-O', '--output', required=True, help="Path to the output file where differences will be written.")
     parser.add_argument('-FILTER', action='store_true', help="Only include variants that passed the filter (PASS).")
+    parser.add_argument('-R', '--regions', help="Only include variants of these comma-separated regions (eg. Chr1:1000000-2000000,Chr2).\n"
+                                                "Bgzipped VCF files with a tabix index (.tbi) are only read on these regions.")
+    parser.add_argument('-NORMALISE', action='store_true', help="Write the table used by the pipeline: tab-separated, '.vcf.gz' removed from the names\n"
+                                                              "and variants absent from a file written as 0 (output compressed if named *.gz).")
+    parser.add_argument('-M', '--min-snps-per-chrom', type=int, default=0, help="Skip chromosomes with less than this number of SNPs in the founders (eg. 200).")
+    parser.add_argument('-GENOTYPES', action='store_true', help="Keep heterozygous and missing calls, writing one genotype code per file instead of the Alt allele:\n"
+                                                              "0 hom-ref (or absent), 1 het, 2 hom-alt, 3 missing (see ComparisonTable -g).")
 
     # Parse the arguments
     args = parser.parse_args()
 
+    try:
+        regions = parse_regions(args.regions) if args.regions else None
+    except ValueError as error:
+        parser.error(str(error))
+
     # Read the list of VCF files from the file provided with the -L flag
     with open(args.list, 'r') as file_list:
         vcf_files = [line.strip() for line in file_list if line.strip()]
@@ -147,34 +445,8 @@ if __name__ == "__main__":
     # Record the start time for measuring execution duration
     start_time = time.time()
 
-    # List to store paths of temporary files
-    temp_files = []
-
-    # Collect all file names for the header
-    all_files = [args.target1, args.target2] + vcf_files
-
-    # Determine the optimal number of workers, using half of available CPUs for safety
-    max_workers = min(len(vcf_files), max(1, os.cpu_count()//2))
-
-    # Use ThreadPoolExecutor to process the VCF files in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit the target VCF files for processing
-        future_p1 = executor.submit(extract_variants, args.target1, args.FILTER)
-        future_p2 = executor.submit(extract_variants, args.target2, args.FILTER)
-
-        # Submit each file in the list for processing in parallel
-        future_vcfs = {executor.submit(extract_variants, vcf_file, args.FILTER): vcf_file for vcf_file in vcf_files}
-
-        # Collect the temporary file paths
-        temp_files.append(future_p1.result())
-        temp_files.append(future_p2.result())
-
-        for future in future_vcfs:
-            temp_file = future.result()
-            temp_files.append(temp_file)
-
-    # Now, aggregate the temporary files
-    write_organized_output(temp_files, args.output, all_files)
+    tabulate_vcfs(vcf_files, args.target1, args.target2, args.founders, args.output, args.FILTER, regions, args.min_snps_per_chrom, args.NORMALISE,
+                  args.GENOTYPES)
 
     # Record the end time and calculate elapsed time
     end_time = time.time()
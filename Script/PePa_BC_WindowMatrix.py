@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import io
+import csv
+import argparse
+import time
+from collections import defaultdict
+from itertools import accumulate
+from operator import add, truediv
+
+from PePa_BC_BGZF import BGZFWriter, open_table
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def read_segments(input_file):
+    """
+    Reads the clustered segments and groups them by sample, ancestry and chromosome.
+
+    Parameters:
+        input_file (str): Path to the clustered file (Chromosome, Start, End, Ancestry, filename).
+
+    Returns:
+        segments (dict): Mapping of sample -> (ancestry, chromosome) -> list of (start, end).
+        lengths (dict): Length of each chromosome, taken as the largest End observed.
+        ancestries (list): Sorted list of the ancestries found in the file.
+    """
+    segments = defaultdict(lambda: defaultdict(list))
+    lengths = {}
+    ancestries = set()
+
+    with open_table(input_file, 'r') as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        for row in reader:
+            chrom = row['Chromosome']
+            start = int(row['Start'])
+            end = int(row['End'])
+            segments[row['filename']][(row['Ancestry'], chrom)].append((start, end))
+            ancestries.add(row['Ancestry'])
+            if end > lengths.get(chrom, 0):
+                lengths[chrom] = end
+
+    return segments, lengths, sorted(ancestries)
+
+def accumulate_windows(intervals, n_windows, window):
+    """
+    Accumulates the bp covered by a list of intervals into fixed-size windows.
+
+    Windows fully covered by an interval are filled through a difference array and a single
+    cumulative sum, so the cost is proportional to the number of intervals plus the number of
+    windows, whatever the length of the intervals.
+
+    Parameters:
+        intervals (list): List of (start, end) tuples, 1-based and inclusive.
+        n_windows (int): Number of windows on the chromosome.
+        window (int): Window size in bp.
+
+    Returns:
+        list: bp covered in each window.
+    """
+    partial = [0] * n_windows
+    diff = [0] * n_windows
+
+    for start, end in intervals:
+        first = (start - 1) // window
+        last = (end - 1) // window
+        if first == last:
+            partial[first] += end - start + 1
+        else:
+            # Partially covered windows at both ends, fully covered windows in between
+            partial[first] += (first + 1) * window - start + 1
+            partial[last] += end - last * window
+            diff[first + 1] += window
+            diff[last] -= window
+
+    return list(map(add, partial, accumulate(diff)))
+
+def accumulate_windows_array(starts, ends, offsets, n_windows, window):
+    """
+    NumPy version of accumulate_windows, for the intervals of all the chromosomes of a sample at once.
+
+    The partially covered windows are summed with np.bincount and the fully covered ones through the
+    same difference array, turned into coverage by np.cumsum, so no Python loop runs over the intervals.
+
+    Parameters:
+        starts (array), ends (array): Starts and ends of the intervals, 1-based and inclusive.
+        offsets (array): Index of the first window of the chromosome of each interval.
+        n_windows (int): Number of windows on all the chromosomes.
+        window (int): Window size in bp.
+
+    Returns:
+        array: bp covered in each window.
+    """
+    first = (starts - 1) // window
+    last = (ends - 1) // window
+    spanning = first != last
+
+    # Partially covered windows at both ends (the whole interval when it lies in a single window)
+    head = np.minimum(ends, (first + 1) * window) - starts + 1
+    tail = ends[spanning] - last[spanning] * window
+    first_index = offsets + first
+    last_index = offsets[spanning] + last[spanning]
+    covered = np.bincount(first_index, weights=head, minlength=n_windows)
+    covered += np.bincount(last_index, weights=tail, minlength=n_windows)
+
+    # Fully covered windows in between
+    diff = np.bincount(first_index[spanning] + 1, minlength=n_windows) - np.bincount(last_index, minlength=n_windows)
+    return covered + np.cumsum(diff) * window
+
+def write_window_matrix(segments, lengths, ancestries, window, output_file):
+    """
+    Writes a dense matrix with one row per sample and ancestry and one column per window,
+    holding the fraction of each window covered by that ancestry.
+
+    With NumPy, each row is computed at once by accumulate_windows_array, otherwise the chromosomes
+    are accumulated one by one by accumulate_windows.
+
+    Parameters:
+        segments (dict): Segments grouped by sample, as returned by read_segments.
+        lengths (dict): Length of each chromosome.
+        ancestries (list): Ancestries to report for every sample.
+        window (int): Window size in bp.
+        output_file (str): Path to the bgzip-compressed TSV output file.
+    """
+    chromosomes = sorted(lengths)
+
+    # Build the common grid of windows shared by all samples
+    n_windows = {}
+    offsets = {}
+    labels = []
+    window_lengths = []
+    for chrom in chromosomes:
+        n_windows[chrom] = (lengths[chrom] - 1) // window + 1
+        offsets[chrom] = len(labels)
+        for i in range(n_windows[chrom]):
+            window_start = i * window + 1
+            window_end = min((i + 1) * window, lengths[chrom])
+            labels.append(f"{chrom}:{window_start}-{window_end}")
+            window_lengths.append(window_end - window_start + 1)
+
+    if np is not None:
+        window_array = np.array(window_lengths, dtype=np.float64)
+
+    # Rows are compressed in BGZF blocks by several threads
+    with io.TextIOWrapper(BGZFWriter(output_file), encoding='utf-8', newline='') as out:
+        writer = csv.writer(out, delimiter='\t')
+        writer.writerow(["Sample", "Ancestry"] + labels)
+
+        for sample, sample_segments in segments.items():
+            for ancestry in ancestries:
+                if np is not None:
+                    arrays = [np.array(sample_segments.get((ancestry, chrom), []), dtype=np.int64).reshape(-1, 2) for chrom in chromosomes]
+                    starts, ends = np.concatenate(arrays).T
+                    firsts = np.repeat([offsets[chrom] for chrom in chromosomes], [len(array) for array in arrays])
+                    covered = accumulate_windows_array(starts, ends, firsts, len(labels), window)
+                    fractions = ['%.4g' % fraction for fraction in (covered / window_array).tolist()]
+                else:
+                    covered = []
+                    for chrom in chromosomes:
+                        covered.extend(accumulate_windows(sample_segments.get((ancestry, chrom), []), n_windows[chrom], window))
+                    fractions = ['%.4g' % fraction for fraction in map(truediv, covered, window_lengths)]
+                writer.writerow([sample, ancestry] + fractions)
+
+    print(f"Window matrix of {len(segments)} samples x {len(labels)} windows written in: '{output_file}'")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts clustered ancestry segments into a samples x windows matrix of ancestry fractions.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-I', '--input', required=True,
+                        help='Path to the clustered file (eg. <basename>_Clustered.csv).')
+    parser.add_argument('-O', '--output', required=True,
+                        help='Path to the gzip-compressed output matrix (eg. <basename>_WindowMatrix.tsv.gz).')
+    parser.add_argument('-W', '--window', required=True, type=int,
+                        help='Window size in bp (eg. 10000).')
+    args = parser.parse_args()
+
+    if args.window <= 0:
+        parser.error("the window size must be a positive number of bp")
+
+    segments, lengths, ancestries = read_segments(args.input)
+    write_window_matrix(segments, lengths, ancestries, args.window, args.output)
+
+if __name__ == '__main__':
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
@@ -5,6 +5,8 @@ import argparse
 import os
 from collections import defaultdict
 
+from PePa_BC_BGZF import open_table
+
 def read_csv(file_path, delimiter='\t'):
     """
     Reads a CSV file with a specified delimiter and returns its contents as a list of dictionaries.
@@ -16,7 +18,7 @@ def read_csv(file_path, delimiter='\t'):
     Returns:
     list of dict: List of rows, where each row is represented as a dictionary.
     """
-    with open(file_path, 'r') as file:
+    with open_table(file_path, 'r') as file:
         reader = csv.DictReader(file, delimiter=delimiter)
         return list(reader)
 
@@ -117,7 +119,7 @@ def main():
         write_csv(temp_file_path, result_data, fieldnames)
     
     # Concatenate all temporary CSV files into one
-    with open(args.output, 'w', newline='') as outfile:
+    with open_table(args.output, 'w', newline='') as outfile:
         writer = None
         for file_name in temp_files:
             with open(file_name, 'r') as infile:
@@ -54,8 +54,8 @@ for (file in unique(df$filename)) {
     # Create the plot with strip.text size 16 and bold for the first file
     p <- ggplot(subset_data, aes(xmin = Start, xmax = End, ymin = 0, ymax = 1, fill = Ancestry)) +
       geom_rect(color = "white") +  # Draw rectangles with white borders
-      scale_fill_manual(values = c("blue", "red", "white")) +  # Define fill colors for bars
-      scale_color_manual(values = c("blue", "red", "white")) +  # Define edge colors for bars
+      scale_fill_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = "white")) +  # Define fill colors for bars
+      scale_color_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = "white")) +  # Define edge colors for bars
       theme_minimal() +  
       facet_wrap(~Chromosome, nrow=1, scales = "free_x") +
       theme(
@@ -84,8 +84,8 @@ for (file in unique(df$filename)) {
     # Create the plot with strip.text element_blank for other files
     p <- ggplot(subset_data, aes(xmin = Start, xmax = End, ymin = 0, ymax = 1, fill = Ancestry)) +
       geom_rect(color = "white") +  # Draw rectangles with white borders
-      scale_fill_manual(values = c("blue", "red", "grey")) +  # Define fill colors for bars
-      scale_color_manual(values = c("blue", "red", "grey")) +  # Define edge colors for bars
+      scale_fill_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = "grey")) +  # Define fill colors for bars
+      scale_color_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = "grey")) +  # Define edge colors for bars
       theme_minimal() +  
       facet_wrap(~Chromosome, nrow=1, scales = "free_x") +
       theme(
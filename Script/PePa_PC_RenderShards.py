@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from PePa_BC_BGZF import open_table
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# R script, sample and chromosome columns of its input, and outputs (suffixes of the base name) of each plot
+PLOTS = {
+    'paint': {
+        'script': 'PePa_PC_GenomePaint.r',
+        'sample': 'filename',
+        'chromosome': 'Chromosome',
+        'images': ['PePa_Paint.png'],
+        'summary': None,
+    },
+    'genome': {
+        'script': 'PePa_PC_ntPerc.r',
+        'sample': 'filename',
+        'chromosome': 'Chromosome',
+        'images': ['GenomeBarPlot.pdf'],
+        'summary': 'GenomePercentage.csv',
+    },
+    'genes': {
+        'script': 'PePa_PC_GeneCountPerc.r',
+        'sample': 'FileName',
+        'chromosome': 'Sequence Name',
+        'images': ['GeneBarPlot.pdf'],
+        'summary': 'GeneAncPerc.csv',
+    },
+}
+
+# Number of chromosomes painted by PePa_PC_GenomePaint.r
+PAINTED_CHROMOSOMES = 7
+
+def top_chromosomes(input_file, n):
+    """
+    Selects the chromosomes painted by PePa_PC_GenomePaint.r, with the same rule applied to the whole table,
+    so that every shard paints the same chromosomes.
+
+    Returns:
+        set: Names of the n chromosomes with the largest span of segment lengths.
+    """
+    shortest = {}
+    longest = {}
+    with open_table(input_file, 'r') as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        for row in reader:
+            chrom = row['Chromosome']
+            length = int(row['End']) - int(row['Start'])
+            shortest[chrom] = min(length, shortest.get(chrom, length))
+            longest[chrom] = max(length, longest.get(chrom, length))
+
+    ranked = sorted(sorted(longest), key=lambda chrom: -(longest[chrom] - shortest[chrom]))
+    return set(ranked[:n])
+
+def split_table(input_file, shard_dir, column, batch=None, chromosomes=None):
+    """
+    Splits a tab-separated table into shards of samples or of chromosomes, in a single pass.
+
+    Samples are assigned to shards of `batch` samples in their order of appearance; without a batch
+    size, each value of the column (eg. each chromosome) gets its own shard.
+    Rows are copied unchanged, so each shard is a valid input for the R scripts.
+
+    Parameters:
+        input_file (str): Path to the table.
+        shard_dir (str): Folder where the shard tables are written.
+        column (str): Name of the column used to shard the rows.
+        batch (int): Number of samples per shard, or None for one shard per value of the column.
+        chromosomes (set): Only keep the rows of these chromosomes (first column), or None for all rows.
+
+    Returns:
+        list: (shard name, path to the shard table, list of the values of the column in the shard) tuples.
+    """
+    # Shards of a previous rendering may have been split differently
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    shards = {}
+    members = defaultdict(list)
+    files = {}
+
+    with open_table(input_file, 'r') as file:
+        header = file.readline()
+        index = header.rstrip('\r\n').split('\t').index(column)
+        for line in file:
+            fields = line.split('\t')
+            if chromosomes is not None and fields[0] not in chromosomes:
+                continue
+            value = fields[index].rstrip('\r\n')
+
+            if value not in shards:
+                if batch:
+                    shards[value] = f"part{len(shards) // batch + 1:03d}"
+                else:
+                    shards[value] = re.sub(r'[^\w.-]', '_', value)
+                members[shards[value]].append(value)
+            name = shards[value]
+
+            if name not in files:
+                files[name] = open(os.path.join(shard_dir, f"{name}.csv"), 'w')
+                files[name].write(header)
+            files[name].write(line)
+
+    for out in files.values():
+        out.close()
+
+    return [(name, os.path.join(shard_dir, f"{name}.csv"), members[name]) for name in files]
+
+def render_shard(script, shard_input, shard_base, extra_args):
+    """
+    Runs an R plotting script on one shard; its messages are kept in <shard base>.log.
+
+    Returns:
+        int: The exit status of Rscript.
+    """
+    with open(f"{shard_base}.log", 'w') as log:
+        result = subprocess.run(["Rscript", script, shard_input, shard_base] + extra_args,
+                                stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode
+
+def combine_summaries(paths, output_file):
+    """Concatenates the summary tables of the shards, keeping the header of the first one."""
+    with open(output_file, 'w', newline='') as out:
+        for i, path in enumerate(paths):
+            with open(path, 'r', newline='') as file:
+                header = file.readline()
+                if i == 0:
+                    out.write(header)
+                out.writelines(file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Renders the plots of a clustered or gene table in shards of samples or chromosomes, running the R scripts in parallel.\n"
+                    "Shard tables and plots are written in <base>_<plot>_shards/, the summary tables of the shards are concatenated\n"
+                    "into the usual <base>_GenomePercentage.csv or <base>_GeneAncPerc.csv, and the plots of each shard are listed in\n"
+                    "<base>_<Plot>Shards.tsv.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-T', '--type', required=True, choices=sorted(PLOTS),
+                        help="Plot to render: paint (PePa_PC_GenomePaint.r, input <basename>_Clustered.csv),\n"
+                             "genome (PePa_PC_ntPerc.r, input <basename>_ClusteredRaw.csv), genes (PePa_PC_GeneCountPerc.r, input <basename>_GeneAnc.csv).")
+    parser.add_argument('-I', '--input', required=True, help="Path to the input table of the plot.")
+    parser.add_argument('-O', '--output', required=True, help="Base name for the output files.")
+    parser.add_argument('-B', '--batch', type=int, default=50, help="Number of samples per shard (default: 50).")
+    parser.add_argument('-CHR', action='store_true', help="Render one shard per chromosome instead of shards of samples.")
+    parser.add_argument('-S', '--size', help="Cluster size, passed to PePa_PC_ntPerc.r to remove short chromosomes (genome plot only).")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of R processes run in parallel (default: number of CPUs).")
+    args = parser.parse_args()
+
+    if args.batch <= 0:
+        parser.error("the number of samples per shard must be positive")
+    if args.type == 'genome' and not args.size:
+        parser.error("the -S/--size flag is required for the genome plot")
+
+    plot = PLOTS[args.type]
+    shard_dir = f"{args.output}_{args.type}_shards"
+    basename = os.path.basename(args.output)
+
+    # The painting only shows the largest chromosomes: select them on the whole table, not on each shard
+    chromosomes = None
+    if args.type == 'paint':
+        chromosomes = top_chromosomes(args.input, PAINTED_CHROMOSOMES)
+
+    column = plot['chromosome'] if args.CHR else plot['sample']
+    shards = split_table(args.input, shard_dir, column, None if args.CHR else args.batch, chromosomes)
+    print(f"Rendering the {args.type} plot in {len(shards)} shards of {'chromosomes' if args.CHR else 'samples'}")
+
+    script = os.path.join(SCRIPT_DIR, plot['script'])
+    extra_args = [args.size] if args.type == 'genome' else []
+    max_workers = args.workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(render_shard, script, shard_input, os.path.join(shard_dir, f"{basename}_{name}"), extra_args)
+                   for name, shard_input, _ in shards]
+        status = [future.result() for future in futures]
+
+    failed = [name for (name, _, _), code in zip(shards, status) if code != 0]
+    if failed:
+        print(f"Error: Rendering failed for the shards: {' '.join(failed)} (see the .log files in '{shard_dir}')")
+        sys.exit(1)
+
+    if plot['summary']:
+        summary_file = f"{args.output}_{plot['summary']}"
+        combine_summaries([os.path.join(shard_dir, f"{basename}_{name}_{plot['summary']}") for name, _, _ in shards], summary_file)
+        print(f"Summary of all the shards written in: '{summary_file}'")
+
+    manifest = f"{args.output}_{args.type.capitalize()}Shards.tsv"
+    with open(manifest, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        writer.writerow(["Shard", "Members", "Plots"])
+        for name, _, values in shards:
+            images = [os.path.join(shard_dir, f"{basename}_{name}_{image}") for image in plot['images']]
+            writer.writerow([name, ','.join(values), ','.join(images)])
+    print(f"Plots of each shard listed in: '{manifest}'")
+
+if __name__ == "__main__":
+    # Record the start time for measuring execution duration
+    start_time = time.time()
+    main()
+
+    # Record the end time and calculate elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time  # Time taken in seconds
+    print(f"Total execution time: {elapsed_time:.2f} seconds")
@@ -64,8 +64,8 @@ filter_results <- filter_results[order(filter_results$Individuals, filter_result
 p = ggplot(filter_results, aes(x = Chromosome, y = Percentage, color = Ancestry, fill = Ancestry)) +
   geom_bar(stat = "identity", position = "stack") +
   facet_wrap(~Individuals) +  theme_bw()  + 
-  scale_fill_manual(values = c("blue", "red", 'darkgrey')) + # Define the fill for the bars 
-  scale_color_manual(values = c("blue", "red", 'darkgrey')) + # Define the colors for the bars edges
+  scale_fill_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = 'darkgrey')) + # Define the fill for the bars 
+  scale_color_manual(values = c(Ancestry1 = "blue", Ancestry2 = "red", Het = "purple", Unknown = 'darkgrey')) + # Define the colors for the bars edges
   theme(strip.text.x = element_text(size = 24, face = "bold")) + 
   ylab("Percentage (%)") + xlab("Chromosomes") +
   theme(
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Script'))
+
+np = pytest.importorskip("numpy")
+from PePa_BC_HMMAncestry import emission_table
+
+@pytest.mark.parametrize("n_founders, het", [(2, False), (2, True), (3, False), (8, False)])
+def test_emission_rows_are_distributions(n_founders, het):
+    table = emission_table(n_founders, 0.01, 0.05, het)
+    assert np.allclose(np.exp(table).sum(1), 1)
+
+def test_codes_that_cannot_occur_get_no_mass():
+    # Label tables filtered with ComparisonTable -b never hold BOTH (code 3)
+    table = emission_table(2, 0.01, 0.05, True, observed={0, 1, 2, 4})
+    assert np.allclose(np.exp(table).sum(1), 1)
+    assert np.all(np.exp(table[:, 3]) == 0)
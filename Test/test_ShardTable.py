@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Script'))
+
+from PePa_BC_ShardTable import create_queue, shard_name, wait_for_shards, merge_shards
+
+def write_vcf(path, calls):
+    with open(path, 'w') as file:
+        file.write("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n")
+        for pos, genotype in calls:
+            file.write(f"Chr1\t{pos}\t.\tA\tG\t50\tPASS\t.\tGT\t{genotype}\n")
+
+def test_expired_lease_of_a_dead_worker_is_taken_over(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_vcf("P1.vcf", [(100, "1/1")])
+    write_vcf("P2.vcf", [(200, "1/1")])
+    samples = [f"S{i}.vcf" for i in range(4)]
+    for i, sample in enumerate(samples):
+        write_vcf(sample, [(100 if i % 2 else 200, "1/1")])
+
+    queue = create_queue("queue", samples, "P1.vcf", "P2.vcf", [], False, 2)
+
+    # A remote worker died while holding the lease of the first shard
+    lock_path = os.path.join("queue", f"{shard_name(queue, 0)}.lock")
+    with open(lock_path, 'w') as file:
+        file.write("remote:1\n")
+    expired = time.time() - 60
+    os.utime(lock_path, (expired, expired))
+
+    waiting = threading.Thread(target=wait_for_shards, args=(str(tmp_path / "queue"), 30, 0.1), daemon=True)
+    waiting.start()
+    waiting.join(timeout=60)
+    assert not waiting.is_alive()
+
+    merge_shards(str(tmp_path / "queue"), str(tmp_path / "merged.csv"))
+    with open(tmp_path / "merged.csv") as file:
+        rows = file.read().splitlines()
+    assert rows[1:] == ["Chr1,100,A,G,-,-,G,-,G", "Chr1,200,A,-,G,G,-,G,-"]